@@ -8,9 +8,12 @@ from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
 from email.MIMEImage import MIMEImage
 import logging
+import traceback
 from django.utils import timezone
+from django.conf import settings
+from django.db.models import Avg, Count, Sum
 from dateutil.relativedelta import relativedelta
-from website.get_db_engine import get_db_engine
+from website.cache_backend import get_cache_backend
 from haystack.management.commands import update_index
 
 
@@ -124,31 +127,117 @@ class Job:
         )
 
 
-def cache_buster(days_back=2):
+def cache_buster(budget=None):
     """
-    When run will remove all tables that are for old cache
+    When run will remove all tables past their query's TTL and stale
+    window, then the least recently used until the cache fits in
+    settings.CACHE_SCRATCH_BYTES
     """
-    # Get all dead tables
-    qc = website.models.QueryCache.objects.filter(
-        run_time__lt=timezone.now() - relativedelta(days=days_back)
-    ).order_by('run_time').all()[:100]
-    for q in qc:
-        if q.is_expired:
-            # Drop them like they are hot!
-            logging.warning('Dropping table %s' % (q.table_name))
-            drop_table(q.table_name)
-            q.delete()
-
-
-def drop_table(table_name):
+    if budget is None:
+        budget = getattr(settings, 'CACHE_SCRATCH_BYTES', None)
+    caches = website.models.QueryCache.objects
+    # Get all dead tables, results in their stale window are still served
+    evict = []
+    for cache in caches.select_related('query__db', 'db').iterator():
+        db = cache.db
+        if db is None and cache.query is not None:
+            db = cache.query.db
+        ttl, stale_ttl = website.query.cache_ttl(db, cache.query)
+        if cache.is_expired(ttl + stale_ttl):
+            evict.append((cache.id, cache.table_name, cache.backend,
+                          cache.byte_size))
+    if budget is not None:
+        evicted_ids = set(e[0] for e in evict)
+        total = caches.aggregate(Sum('byte_size'))['byte_size__sum'] or 0
+        total -= sum(e[3] for e in evict)
+        for cache in caches.order_by('last_access').values_list(
+                'id', 'table_name', 'backend', 'byte_size').iterator():
+            if total <= budget:
+                break
+            if cache[0] not in evicted_ids:
+                evict.append(cache)
+                total -= cache[3]
+    evict_caches(evict)
+    return len(evict)
+
+
+def evict_caches(caches, batch_size=None):
+    """
+    Drops (id, table_name, backend, byte_size) cache entries in batches
+    """
+    if batch_size is None:
+        batch_size = getattr(settings, 'CACHE_EVICTION_BATCH', 500)
+    by_backend = {}
+    for cache in caches:
+        by_backend.setdefault(cache[2], []).append(cache)
+    for backend, backend_caches in by_backend.items():
+        # Drop them like they are hot!
+        logging.warning('Dropping %s %s tables' % (
+            len(backend_caches), backend))
+        get_cache_backend(backend).drop_many(
+            [c[1] for c in backend_caches], batch_size)
+        for i in range(0, len(backend_caches), batch_size):
+            website.models.QueryCache.objects.filter(id__in=[
+                c[0] for c in backend_caches[i:i + batch_size]]).delete()
+
+
+def rank_queries(lookback_days=7, limit=20):
+    """
+    Ranks cacheable queries by views in the last lookback_days times
+    the average time they take to run without the cache
+    returns a list of (query_id, score), best first
+    """
+    views = dict(website.models.QueryView.objects.filter(
+        view_time__gte=timezone.now() - relativedelta(days=lookback_days),
+        query__cacheable=True,
+    ).values_list('query').annotate(Count('id')))
+    costs = dict(website.models.QueryView.objects.filter(
+        query_id__in=views.keys(),
+        used_cache=False,
+    ).values_list('query').annotate(Avg('execution_time')))
+    scores = [(query_id, view_count * costs.get(query_id, 0.0))
+              for query_id, view_count in views.items()]
+    scores = [s for s in scores if s[1] > 0]
+    scores.sort(key=lambda s: s[1], reverse=True)
+    return scores[:limit]
+
+
+def cache_warmer():
+    """
+    Re-runs the most used and most expensive queries with their default
+    parameters when their cache is about to expire
+    """
+    warming = getattr(settings, 'CACHE_WARMING', {})
+    refresh_window = relativedelta(
+        seconds=warming.get('REFRESH_WINDOW', 3600))
+    warmed = []
+    for query_id, score in rank_queries(
+            warming.get('LOOKBACK_DAYS', 7), warming.get('MAX_QUERIES', 20)):
+        try:
+            query = website.models.Query.objects.get(id=query_id)
+            lq = website.query.LoadQuery(
+                query_id=query_id, user=query.owner, cacheable=True)
+            q = lq.prepare_query()
+            # Same hash run_query uses to find the cache
+            q.run_query_hash()
+            if q.check_cache(allow_stale=False):
+                ttl = relativedelta(seconds=q.get_cache_ttl()[0])
+                if q.cache_run_time + ttl > timezone.now() + refresh_window:
+                    continue
+            q.force_refresh = True
+            q.run_query(write_behind=False, record_view=False)
+            warmed.append(query_id)
+        except Exception:
+            logging.warning('Could not warm query %s\n%s' % (
+                query_id, traceback.format_exc()))
+    return warmed
+
+
+def drop_table(table_name, backend='mysql'):
     """
     Drops given table from the scratch disk
     """
-    engine = get_db_engine()
-    c = engine.connect()
-    query_text = """drop table %s""" % (table_name)
-    c.execute(query_text)
-    c.close()
+    get_cache_backend(backend).drop(table_name)
 
 
 def scheduled_job(frequency):
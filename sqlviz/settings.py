@@ -244,6 +244,88 @@ CUSTOM_DATABASES = {
     )
 }
 
+# Connection pooling for the source databases and the write_to database
+DB_POOL = {
+    'POOL_SIZE': 5,
+    'MAX_OVERFLOW': 10,
+    'POOL_RECYCLE': 3600,
+    'PRE_PING': True,
+}
+# Pool for the write_to connections holding cache locks. A lock keeps its
+# connection while the query runs and until its result is saved, so locks
+# get their own pool. A query waits POOL_TIMEOUT seconds for one and then
+# runs without the lock
+LOCK_POOL = {
+    'POOL_SIZE': 5,
+    'MAX_OVERFLOW': 45,
+    'POOL_TIMEOUT': 5,
+    'POOL_RECYCLE': 3600,
+    'PRE_PING': True,
+}
+
+# Rows per fetch when streaming unlimited queries from a server side cursor
+STREAMING_FETCH_SIZE = 10000
+
+# Most precedent queries run at the same time for one query
+PRECEDENT_THREADS = 4
+
+# Batch dashboard API, threads per request and queries at once per source Db
+BATCH_THREADS = 8
+BATCH_DB_CONCURRENCY = 4
+
+# Worker threads per process running asynchronous query jobs
+QUERY_JOB_WORKERS = 4
+
+# Seconds to wait for another process running the same query to fill the
+# cache before running it anyway
+CACHE_LOCK_TIMEOUT = 60
+
+# Bytes of query results kept in memory by each process, 0 disables
+RESULT_CACHE_BYTES = 256 * 1024 * 1024
+# Bytes of serialized query API responses kept in memory by each process,
+# and whether a gzipped copy is kept for clients accepting gzip
+PAYLOAD_CACHE_BYTES = 64 * 1024 * 1024
+PAYLOAD_CACHE_GZIP = True
+# Seconds each process reuses a query's row, defaults, precedents and tags.
+# Changes made in the same process are seen at once, 0 disables
+QUERY_DEFINITION_TTL = 5 * 60
+# Seconds each process reuses a user's groups and who may run which query
+ACL_CACHE_TTL = 5 * 60
+
+# Where cached results are stored, 'mysql' tables in the write_to database
+# or 'file' for column files under CACHE_DIR. Precedents always use mysql
+CACHE_BACKEND = 'mysql'
+CACHE_DIR = BASE_DIR + '/cache/'
+# Write mysql cache tables with LOAD DATA LOCAL INFILE / COPY instead of
+# INSERTs, falling back to INSERTs when the server does not allow
+# local_infile
+CACHE_BULK_LOAD = True
+
+# Background threads saving results to the cache after the response, and
+# writes queued per thread before requests save synchronously, 0 disables
+CACHE_WRITERS = 2
+CACHE_WRITE_QUEUE_SIZE = 16
+
+# cache_buster drops the least recently used results until the cache is
+# under this many bytes, dropping this many tables per statement
+CACHE_SCRATCH_BYTES = 10 * 1024 * 1024 * 1024
+CACHE_EVICTION_BATCH = 500
+
+# Seconds cached results are fresh for, and how long after that a stale
+# result is served while it is refreshed in the background. Queries and
+# databases can override both
+CACHE_TTL = 24 * 60 * 60
+CACHE_STALE_TTL = 0
+
+# cache_warmer re-runs the MAX_QUERIES queries with the most views times
+# run time over LOOKBACK_DAYS when their cache expires within
+# REFRESH_WINDOW seconds, keep the window longer than the cron interval
+CACHE_WARMING = {
+    'LOOKBACK_DAYS': 7,
+    'MAX_QUERIES': 20,
+    'REFRESH_WINDOW': 60 * 60,
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/dev/topics/i18n/
@@ -280,6 +362,7 @@ CRONJOBS = [
     ('0 0 * * 0', 'cron.cron.scheduled_job', ['weekly']),
     ('0 0 1 * *', 'cron.cron.scheduled_job', ['monthly']),
     ('0 0 * * *', 'cron.cron.cache_buster'),
+    ('*/30 * * * *', 'cron.cron.cache_warmer'),
     ('*/15 * * * *', 'cron.cron.refresh_search_index')
 ]
 
@@ -0,0 +1,63 @@
+"""
+Rows/sec of ManipulateData.pandas_to_array against the old iterrows path
+
+    python -m tests.benchmarks.pandas_to_array
+"""
+from __future__ import print_function
+import os
+import time
+import datetime
+import decimal
+
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sqlviz.settings")
+import django  # noqa
+django.setup()
+import website.query  # noqa
+
+SIZES = [1000, 100000, 1000000]
+# iterrows is too slow to be worth waiting for on the largest frame
+ITERROWS_MAX_SIZE = 100000
+
+
+def make_frame(rows):
+    start = datetime.datetime(2015, 1, 1)
+    return pd.DataFrame({
+        'id': np.arange(rows),
+        'value': np.random.rand(rows),
+        'name': ['name_%s' % (i % 100) for i in range(rows)],
+        'day': pd.date_range(start, periods=rows, freq='min'),
+        'amount': [decimal.Decimal(i % 1000) / 100 for i in range(rows)]
+    }, columns=['id', 'value', 'name', 'day', 'amount'])
+
+
+def iterrows_to_array(data):
+    data_array = [data.columns.tolist()]
+    data_array += [[v for v in r[1]] for r in data.iterrows()]
+    return data_array
+
+
+def rows_per_second(function, rows):
+    start_time = time.time()
+    function()
+    return rows / (time.time() - start_time)
+
+
+def main():
+    md = website.query.ManipulateData(query_text='', db='')
+    print('%10s %15s %15s' % ('rows', 'columnar r/s', 'iterrows r/s'))
+    for rows in SIZES:
+        md.data = make_frame(rows)
+        columnar = rows_per_second(md.pandas_to_array, rows)
+        if rows <= ITERROWS_MAX_SIZE:
+            iterrows = '%15.0f' % rows_per_second(
+                lambda: iterrows_to_array(md.data), rows)
+        else:
+            iterrows = '%15s' % '-'
+        print('%10s %15.0f %s' % (rows, columnar, iterrows))
+
+
+if __name__ == '__main__':
+    main()
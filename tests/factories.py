@@ -111,3 +111,11 @@ class QueryPrecedentFactory(factory.django.DjangoModelFactory):
         model = website.models.QueryPrecedent
     final_query = factory.SubFactory(QueryFactory)
     preceding_query = factory.SubFactory(QueryFactory)
+
+
+class QueryCacheFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = website.models.QueryCache
+    query = factory.SubFactory(QueryFactory)
+    table_name = factory.Sequence(lambda x: "table_{}".format(x))
+    hash = "hash"
@@ -1,9 +1,14 @@
+from StringIO import StringIO
+import gzip
 import json
+import mock
 
 from ..factories import QueryFactory, QueryDefaultFactory, UserFactory, \
-    QueryPrecedentFactory
+    QueryPrecedentFactory, DashboardQueryFactory
 from .testcases import APITestCase
+from website.models import QueryJob
 import datetime
+import time
 #  import logging
 import os
 
@@ -104,6 +109,20 @@ class QueryAPITest(QueryAPITestCase):
             'data': [[user.id, user.username]],
         })
 
+    def test_columnar_format(self):
+        user = self.create_user()
+        query = QueryFactory(
+            query_text="select id, username from auth_user",
+            owner=user,
+        )
+        self.login()
+        data = self.get_query(query.id, {'format': 'columnar'})
+        self.assert_query_data(data, data={
+            'columns': ['id', 'username'],
+            'dtypes': ['integer', 'string'],
+            'data': [[user.id], [user.username]],
+        })
+
     def test_time(self):
         """
         Create query that returns a time stamp
@@ -374,3 +393,217 @@ class QueryAPIPermissionTest(QueryAPITestCase):
         query = self.make_query(with_tags=True)
         data = self.get_query(query.id)
         self.assertFalse(data['error'])
+
+
+class QueryBatchAPITest(QueryAPITestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        self.login()
+
+    def get_batch(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        lines = ''.join(response.streaming_content).splitlines()
+        return dict(
+            (data['query_id'], data) for data in map(json.loads, lines))
+
+    def test_query_batch(self):
+        queries = [
+            QueryFactory(
+                query_text="select id from auth_user",
+                owner=self.user,
+                title='batch_id'),
+            QueryFactory(
+                query_text="select username from auth_user",
+                owner=self.user,
+                title='batch_username')
+        ]
+        data = self.get_batch('/api/query_batch/{},{}'.format(
+            queries[0].id, queries[1].id))
+        self.assertEqual(data[queries[0].id]['data'], {
+            'columns': ['id'], 'data': [[self.user.id]]})
+        self.assertEqual(data[queries[1].id]['data'], {
+            'columns': ['username'], 'data': [[self.user.username]]})
+
+    def test_query_batch_empty_ids(self):
+        query = QueryFactory(
+            query_text="select id from auth_user",
+            owner=self.user,
+            title='batch_id')
+        data = self.get_batch('/api/query_batch/{},,'.format(query.id))
+        self.assertEqual(data.keys(), [query.id])
+        self.assertFalse(data[query.id]['error'])
+
+    def test_query_batch_tile_error(self):
+        query = QueryFactory(
+            query_text="select id from auth_user",
+            owner=self.user,
+            title='batch_id')
+
+        def query_payload(query_id, user, parameters):
+            if int(query_id) != query.id:
+                raise ValueError('boom')
+            return ('{"error": false}', None, None)
+        with mock.patch('website.views.query_payload', query_payload):
+            data = self.get_batch('/api/query_batch/{},{}'.format(
+                query.id + 1, query.id))
+        self.assertEqual(len(data), 2)
+        self.assertTrue(data[query.id + 1]['error'])
+
+    def test_dashboard_batch(self):
+        dashboard_query = DashboardQueryFactory(
+            query__owner=self.user,
+            query__query_text="select id from auth_user",
+            dashboard__owner=self.user)
+        data = self.get_batch(
+            '/api/dashboard/{}'.format(dashboard_query.dashboard.id))
+        self.assertEqual(data.keys(), [dashboard_query.query.id])
+        self.assertFalse(data[dashboard_query.query.id]['error'])
+
+
+class QueryJobAPITest(QueryAPITestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        self.login()
+
+    def get_json(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def wait_for_job(self, job_id, timeout=10):
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            status = self.get_json('/api/job/{}'.format(job_id))
+            if status['state'] in ('done', 'failed'):
+                return status
+            time.sleep(0.1)
+        self.fail("Job {} did not finish".format(job_id))
+
+    def test_job(self):
+        query = QueryFactory(
+            query_text="select id, username from auth_user",
+            owner=self.user,
+        )
+        job = self.get_json('/api/query/{}/job'.format(query.id))
+        self.assertIn(job['state'], ('queued', 'running', 'done'))
+        status = self.wait_for_job(job['job_id'])
+        self.assertEqual(status['state'], 'done')
+        self.assertEqual(status['progress'], 1.0)
+        data = self.get_json('/api/job/{}/result'.format(job['job_id']))
+        self.assertEqual(data['data'], {
+            'columns': ['id', 'username'],
+            'data': [[self.user.id, self.user.username]],
+        })
+
+    def test_failed_job(self):
+        query = QueryFactory(
+            query_text="select id from auth_user where id < 0",
+            owner=self.user,
+        )
+        job = self.get_json('/api/query/{}/job'.format(query.id))
+        status = self.wait_for_job(job['job_id'])
+        self.assertEqual(status['state'], 'failed')
+        self.assertTrue(status['error'])
+        data = self.get_json('/api/job/{}/result'.format(job['job_id']))
+        self.assertTrue(data['error'])
+
+    def test_job_unknown_query(self):
+        query = QueryFactory(owner=self.user)
+        response = self.client.get('/api/query/{}/job'.format(query.id + 1))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(QueryJob.objects.count(), 0)
+
+    def test_job_without_permission(self):
+        query = QueryFactory(owner=self.user, db__tags=['perm1'])
+        data = self.get_json('/api/query/{}/job'.format(query.id))
+        self.assertTrue(data['error'])
+        self.assertIn("permission", data['data'])
+        self.assertEqual(QueryJob.objects.count(), 0)
+
+    def test_other_users_job(self):
+        query = QueryFactory(owner=self.user)
+        job = self.get_json('/api/query/{}/job'.format(query.id))
+        self.client.logout()
+        self.create_user(username='other')
+        self.client.login(username='other', password=self.password)
+        response = self.client.get('/api/job/{}'.format(job['job_id']))
+        self.assertEqual(response.status_code, 404)
+
+
+class QueryCancelAPITest(QueryAPITestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        self.login()
+
+    def test_cancel_nothing_running(self):
+        query = QueryFactory(owner=self.user)
+        response = self.client.post('/api/query/{}/cancel'.format(query.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.content), {'data': 0, 'error': False})
+
+    def test_cancel_requires_post(self):
+        query = QueryFactory(owner=self.user)
+        response = self.client.get('/api/query/{}/cancel'.format(query.id))
+        self.assertEqual(response.status_code, 405)
+
+    def test_statement_timeout(self):
+        # SLEEP() returns 1 when interrupted, a long scan fails instead
+        query = QueryFactory(
+            query_text="""select count(*) as n
+                from information_schema.columns a,
+                information_schema.columns b,
+                information_schema.columns c""",
+            statement_timeout=1,
+            owner=self.user,
+        )
+        data = self.get_query(query.id)
+        self.assertTrue(data['error'])
+        self.assertIn('maximum statement execution time exceeded',
+                      data['data'])
+
+
+class QueryPayloadCacheTest(QueryAPITestCase):
+    def setUp(self):
+        self.user = self.create_user()
+        self.login()
+
+    def test_gzipped_cached_response(self):
+        # Only responses over 1 KB are compressed
+        users = [self.user] + create_users()
+        query = QueryFactory(
+            query_text="select id, username from auth_user order by id",
+            owner=self.user,
+        )
+        for i in range(2):
+            self.get_query(query.id)
+        response = self.client.get(
+            '/api/query/{}'.format(query.id), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        body = gzip.GzipFile(fileobj=StringIO(response.content)).read()
+        self.assertGreater(len(body), 1024)
+        data = json.loads(body)
+        self.assert_query_data(data, cached=True, data={
+            'columns': ['id', 'username'],
+            'data': [[u.id, u.username] for u in users],
+        })
+
+    def test_not_modified(self):
+        query = QueryFactory(
+            query_text="select id, username from auth_user",
+            owner=self.user,
+        )
+        url = '/api/query/{}'.format(query.id)
+        self.assertNotIn('ETag', self.client.get(url))
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, '')
+        self.assertEqual(response['ETag'], etag)
+        # Other formats are different responses
+        response = self.client.get(
+            url + '?format=columnar', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
@@ -2,6 +2,7 @@ from django.test import (LiveServerTestCase as BaseLiveServerTestCase,
                          TransactionTestCase)
 from splinter import Browser
 
+from website import cache_writer
 from ..factories import UserFactory
 
 
@@ -24,6 +25,11 @@ class APITestCase(TestCaseMixin, TransactionTestCase):
     def login(self):
         self.client.login(username=self.username, password=self.password)
 
+    def tearDown(self):
+        # Let background cache writes finish before the tables are flushed
+        cache_writer.flush()
+        super(APITestCase, self).tearDown()
+
 
 class LiveServerTestCase(TestCaseMixin, BaseLiveServerTestCase):
 
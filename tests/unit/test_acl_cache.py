@@ -0,0 +1,91 @@
+from django.contrib.auth.models import Group
+from django.test import TransactionTestCase
+from taggit.models import Tag
+
+from website import acl_cache, definition_cache
+import website.query
+
+from ..factories import DbFactory, QueryFactory, UserFactory
+
+
+class AclCacheTest(TransactionTestCase):
+    def setUp(self):
+        acl_cache.clear()
+        definition_cache.clear()
+        self.user = UserFactory()
+        self.db = DbFactory(tags=['finance'])
+        self.query = QueryFactory(db=self.db, tags=['sales'])
+        self.open_query = QueryFactory(
+            title='open', db=DbFactory(name_short='open', name_long='open'))
+
+    def tearDown(self):
+        acl_cache.clear()
+        definition_cache.clear()
+
+    def check_permission(self, query):
+        lq = website.query.LoadQuery(query_id=query.id, user=self.user)
+        return lq.prepare_query().check_permission()
+
+    def test_resolve(self):
+        self.assertEqual(acl_cache.resolve(set(['a']), set(['a']), set()),
+                         (True, set(['a'])))
+        self.assertEqual(acl_cache.resolve(set(), set(), set(['b'])),
+                         (True, set(['b'])))
+        self.assertEqual(acl_cache.resolve(set(['c']), set(['a']), set()),
+                         (False, set(['a'])))
+
+    def test_decision_memoized(self):
+        self.assertTrue(self.check_permission(self.open_query))
+        with self.assertRaises(Exception):
+            self.check_permission(self.query)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                acl_cache.query_allowed(self.user, self.query.id),
+                (False, set(['finance', 'sales'])))
+
+    def test_group_membership_invalidates(self):
+        self.assertFalse(acl_cache.query_allowed(self.user, self.query.id)[0])
+        self.user.groups.add(Group.objects.create(name='sales'))
+        self.assertTrue(acl_cache.query_allowed(self.user, self.query.id)[0])
+        Group.objects.get(name='sales').user_set.remove(self.user)
+        self.assertFalse(acl_cache.query_allowed(self.user, self.query.id)[0])
+
+    def test_tags_invalidate(self):
+        self.assertTrue(
+            acl_cache.query_allowed(self.user, self.open_query.id)[0])
+        self.open_query.db.tags.add('restricted')
+        self.assertFalse(
+            acl_cache.query_allowed(self.user, self.open_query.id)[0])
+
+    def test_tag_rename_invalidates(self):
+        self.user.groups.add(Group.objects.create(name='sales'))
+        self.assertTrue(acl_cache.query_allowed(self.user, self.query.id)[0])
+        tag = Tag.objects.get(name='sales')
+        tag.name = 'hr'
+        tag.save()
+        self.assertEqual(acl_cache.query_allowed(self.user, self.query.id),
+                         (False, set(['finance', 'hr'])))
+
+    def test_allowed_query_ids(self):
+        self.user.groups.add(Group.objects.create(name='finance'))
+        hidden = QueryFactory(title='hidden', db=self.db, tags=['hr'])
+        query_ids = [self.query.id, self.open_query.id, hidden.id]
+        self.assertEqual(
+            acl_cache.allowed_query_ids(self.user, query_ids),
+            set([self.query.id, self.open_query.id, hidden.id]))
+        self.user.groups.clear()
+        self.assertEqual(
+            acl_cache.allowed_query_ids(self.user, query_ids),
+            set([self.open_query.id]))
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                acl_cache.allowed_query_ids(self.user, query_ids),
+                set([self.open_query.id]))
+            self.assertFalse(
+                acl_cache.query_allowed(self.user, hidden.id)[0])
+
+    def test_superuser(self):
+        admin = UserFactory(is_superuser=True)
+        self.assertEqual(
+            acl_cache.allowed_query_ids(admin, [self.query.id]),
+            set([self.query.id]))
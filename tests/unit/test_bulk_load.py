@@ -0,0 +1,100 @@
+from unittest import TestCase
+from StringIO import StringIO
+import datetime
+import decimal
+import mock
+import numpy as np
+import pandas as pd
+
+from website import bulk_load
+
+
+def frame():
+    return pd.DataFrame({
+        'id': [1, 2],
+        'score': [1.5, np.nan],
+        'name': [u'a\tb', None],
+        'day': [datetime.date(2015, 1, 2), None],
+        'time': pd.to_datetime(['2015-01-02 03:04:05', None]),
+        'amount': [decimal.Decimal('1.25'), None]},
+        columns=['id', 'score', 'name', 'day', 'time', 'amount'])
+
+
+class TestBulkLoad(TestCase):
+    def test_create_table_mysql(self):
+        self.assertEqual(
+            bulk_load.create_table_sql('table_1', frame(), 'mysql'),
+            'CREATE TABLE `table_1` (`id` BIGINT, `score` DOUBLE, '
+            '`name` LONGTEXT, `day` DATE, `time` DATETIME, '
+            '`amount` DOUBLE)')
+
+    def test_create_table_postgres(self):
+        sql = bulk_load.create_table_sql(
+            'table_1', pd.DataFrame({'a"b': [True]}), 'postgresql')
+        self.assertEqual(sql, 'CREATE TABLE "table_1" ("a""b" BOOLEAN)')
+
+    def test_format_value(self):
+        self.assertEqual(bulk_load.format_value(None), '\\N')
+        self.assertEqual(bulk_load.format_value(float('nan')), '\\N')
+        self.assertEqual(bulk_load.format_value(True), '1')
+        self.assertEqual(bulk_load.format_value(0.1), '0.1')
+        self.assertEqual(bulk_load.format_value(u'\xe9\\\n'),
+                         '\xc3\xa9\\\\\\n')
+
+    def test_write_tsv(self):
+        f = StringIO()
+        bulk_load.write_tsv(frame(), f)
+        self.assertEqual(f.getvalue().split('\n'), [
+            '1\t1.5\ta\\tb\t2015-01-02\t2015-01-02 03:04:05\t1.25',
+            '2\t\\N\t\\N\t\\N\t\\N\t\\N',
+            ''])
+
+    def mock_engine(self, dialect):
+        engine = mock.Mock()
+        engine.dialect.name = dialect
+        cursor = engine.raw_connection.return_value.cursor.return_value
+        return engine, cursor
+
+    def test_save_mysql(self):
+        engine, cursor = self.mock_engine('mysql')
+        with mock.patch('uuid.uuid4') as uuid4:
+            uuid4.return_value.hex = 'abc'
+            bulk_load.save(engine, 'table_1', frame())
+        statements = [c[0][0] for c in cursor.execute.call_args_list]
+        self.assertTrue(statements[0].startswith('CREATE TABLE `tmp_abc`'))
+        self.assertEqual(statements[1:], [
+            'LOAD DATA LOCAL INFILE %s INTO TABLE `tmp_abc` '
+            'CHARACTER SET utf8',
+            'CREATE TABLE IF NOT EXISTS `table_1` LIKE `tmp_abc`',
+            'RENAME TABLE `table_1` TO `old_abc`, `tmp_abc` TO `table_1`',
+            'DROP TABLE `old_abc`'])
+        self.assertTrue(engine.raw_connection.return_value.commit.called)
+        self.assertTrue(engine.raw_connection.return_value.close.called)
+
+    def test_save_postgres(self):
+        engine, cursor = self.mock_engine('postgresql')
+        cursor.copy_expert.side_effect = lambda sql, f: setattr(
+            self, 'copied', f.read())
+        with mock.patch('uuid.uuid4') as uuid4:
+            uuid4.return_value.hex = 'abc'
+            bulk_load.save(engine, 'table_1', pd.DataFrame({'a': [1, 2]}))
+        self.assertEqual(cursor.copy_expert.call_args[0][0],
+                         'COPY "tmp_abc" FROM STDIN')
+        self.assertEqual(self.copied, '1\n2\n')
+        statements = [c[0][0] for c in cursor.execute.call_args_list]
+        self.assertEqual(statements[1:], [
+            'DROP TABLE IF EXISTS "table_1"',
+            'ALTER TABLE "tmp_abc" RENAME TO "table_1"'])
+
+    def test_failed_load_keeps_table(self):
+        engine, cursor = self.mock_engine('mysql')
+        cursor.execute.side_effect = [None, ValueError('load failed'),
+                                      None]
+        with mock.patch('uuid.uuid4') as uuid4:
+            uuid4.return_value.hex = 'abc'
+            with self.assertRaises(ValueError):
+                bulk_load.save(engine, 'table_1', frame())
+        statements = [c[0][0] for c in cursor.execute.call_args_list]
+        self.assertEqual(statements[-1], 'DROP TABLE IF EXISTS `tmp_abc`')
+        self.assertFalse([s for s in statements if 'table_1' in s])
+        self.assertTrue(engine.raw_connection.return_value.rollback.called)
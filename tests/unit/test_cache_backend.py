@@ -0,0 +1,121 @@
+from unittest import TestCase
+import datetime
+import mock
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+from website import cache_backend
+
+
+class TestFileCacheBackend(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.backend = cache_backend.FileCacheBackend(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def frame(self):
+        return pd.DataFrame({
+            'a': [1, 2, 3],
+            'b': [1.5, np.nan, 2.5],
+            'c': ['x', None, u'\xe9'],
+            'd': pd.to_datetime(['2015-01-02', None, '2015-01-04'])},
+            columns=['a', 'b', 'c', 'd'])
+
+    def test_round_trip(self):
+        self.backend.save('table_1_h', self.frame())
+        data = self.backend.load('table_1_h')
+        self.assertEqual(data.columns.tolist(), ['a', 'b', 'c', 'd'])
+        self.assertEqual(data['a'].tolist(), [1, 2, 3])
+        self.assertEqual(data['c'].tolist(), ['x', None, u'\xe9'])
+        self.assertEqual(data['d'][0], datetime.datetime(2015, 1, 2))
+        self.assertTrue(pd.isnull(data['d'][1]))
+        self.assertEqual(str(data['d'].dtype), 'datetime64[ns]')
+
+    def test_replace(self):
+        self.backend.save('table_1_h', self.frame())
+        self.backend.save('table_1_h', pd.DataFrame({'z': [9]}))
+        self.assertEqual(
+            self.backend.load('table_1_h').to_dict('list'), {'z': [9]})
+
+    def test_duplicate_columns(self):
+        data = pd.DataFrame([[1, 2]], columns=['a', 'a'])
+        self.backend.save('table_1_h', data)
+        self.assertEqual(
+            self.backend.load('table_1_h').columns.tolist(), ['a', 'a'])
+
+    def test_drop(self):
+        self.backend.save('table_1_h', self.frame())
+        self.backend.drop('table_1_h')
+        self.assertRaises(IOError, self.backend.load, 'table_1_h')
+
+    def test_size(self):
+        self.backend.save('table_1_h', self.frame())
+        path = self.backend.path('table_1_h')
+        self.assertEqual(
+            self.backend.size('table_1_h'),
+            sum(os.path.getsize(os.path.join(path, f))
+                for f in os.listdir(path)))
+        self.assertGreater(self.backend.size('table_1_h'), 3 * 8)
+
+
+class TestMySQLCacheBackend(TestCase):
+    def size(self, dialect, row):
+        engine = mock.Mock()
+        engine.dialect.name = dialect
+        engine.execute.return_value.first.return_value = row
+        with mock.patch('website.get_db_engine.get_db_engine',
+                        return_value=engine):
+            size = cache_backend.MySQLCacheBackend().size('table_1_h')
+        return size, engine
+
+    def test_size(self):
+        size, engine = self.size('mysql', (2048,))
+        self.assertEqual(size, 2048)
+        self.assertIn('information_schema.tables',
+                      engine.execute.call_args[0][0])
+        self.assertEqual(engine.execute.call_args[0][1], ('table_1_h',))
+
+    def test_bulk_load_falls_back_to_inserts(self):
+        engine = mock.Mock()
+        engine.dialect.name = 'mysql'
+        data = mock.Mock()
+        with mock.patch('website.get_db_engine.get_db_engine',
+                        return_value=engine), \
+                mock.patch('website.bulk_load.save',
+                           side_effect=Exception('local_infile is off')):
+            cache_backend.MySQLCacheBackend().save('table_1_h', data)
+        data.to_sql.assert_called_with(
+            'table_1_h', con=engine, if_exists='replace', index=False,
+            chunksize=1000)
+
+    def test_bulk_load(self):
+        engine = mock.Mock()
+        engine.dialect.name = 'mysql'
+        data = mock.Mock()
+        with mock.patch('website.get_db_engine.get_db_engine',
+                        return_value=engine), \
+                mock.patch('website.bulk_load.save') as save:
+            cache_backend.MySQLCacheBackend().save('table_1_h', data)
+        save.assert_called_with(engine, 'table_1_h', data)
+        self.assertFalse(data.to_sql.called)
+
+    def test_size_unknown(self):
+        self.assertEqual(self.size('mysql', None)[0], None)
+        self.assertEqual(self.size('sqlite', (1,))[0], None)
+
+
+class TestGetCacheBackend(TestCase):
+    def test_by_name(self):
+        self.assertIsInstance(cache_backend.get_cache_backend('file'),
+                              cache_backend.FileCacheBackend)
+        self.assertIsInstance(cache_backend.get_cache_backend('mysql'),
+                              cache_backend.MySQLCacheBackend)
+
+    def test_unknown(self):
+        self.assertRaises(
+            ValueError, cache_backend.get_cache_backend, 'parquet')
@@ -0,0 +1,67 @@
+from unittest import TestCase
+import threading
+import mock
+
+from website import cache_writer
+
+
+class FakeQuery(object):
+    def __init__(self):
+        self.data = 'data'
+        self.saved = []
+
+    def save_to_mysql(self, table_name):
+        self.saved.append((self, table_name))
+
+
+class TestCacheWriter(TestCase):
+    def setUp(self):
+        patcher = mock.patch('website.cache_writer.connection')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_write_behind(self):
+        run_query = FakeQuery()
+        lock = mock.Mock()
+        self.assertTrue(cache_writer.submit(run_query, 'table_1_h', lock))
+        cache_writer.flush()
+        saved, table_name = run_query.saved[0]
+        # A copy of the query is saved so later manipulations are not
+        self.assertIsNot(saved, run_query)
+        self.assertEqual(saved.data, 'data')
+        self.assertEqual(table_name, 'table_1_h')
+        self.assertTrue(lock.release.called)
+
+    @mock.patch('website.cache_writer.logging')
+    def test_failed_write_releases_lock(self, logging):
+        run_query = mock.Mock()
+        run_query.save_to_mysql.side_effect = Exception('disk full')
+        lock = mock.Mock()
+        cache_writer.write(run_query, 'table_1_h', lock)
+        lock.release.assert_called_once_with()
+
+    @mock.patch('website.cache_writer.logging')
+    def test_full_queue(self, logging):
+        queue = cache_writer.get_queues()[
+            hash('table_1_h') % len(cache_writer.get_queues())]
+        blocked = threading.Event()
+        release = threading.Event()
+
+        def block(table_name):
+            blocked.set()
+            release.wait()
+        run_query = mock.Mock()
+        run_query.save_to_mysql.side_effect = block
+        with mock.patch('website.cache_writer.copy.copy', lambda q: q):
+            cache_writer.submit(run_query, 'table_1_h')
+            blocked.wait()
+            for i in range(queue.maxsize):
+                self.assertTrue(cache_writer.submit(run_query, 'table_1_h'))
+            self.assertFalse(cache_writer.submit(run_query, 'table_1_h'))
+        release.set()
+        cache_writer.flush()
+
+    @mock.patch('website.cache_writer.settings')
+    def test_disabled(self, settings):
+        settings.CACHE_WRITE_QUEUE_SIZE = 0
+        self.assertFalse(cache_writer.submit(mock.Mock(), 'table_1_h'))
@@ -1,10 +1,16 @@
 from django.test import TransactionTestCase
+from django.test.utils import override_settings
 from django.core import mail
+from django.utils import timezone
+from dateutil.relativedelta import relativedelta
+import mock
 
 from cron import cron
+import website.models
 
 from ..factories import (QueryFactory, DashboardFactory, UserFactory,
-                         DashboardQueryFactory, JobFactory, EmailUserFactory)
+                         DashboardQueryFactory, JobFactory, EmailUserFactory,
+                         QueryCacheFactory, DbFactory)
 
 
 class EmailTest(TransactionTestCase):
@@ -62,3 +68,120 @@ class EmailTest(TransactionTestCase):
             dashboard=self.dashboard,
         )
         EmailUserFactory(job=self.job, user=self.user)
+
+
+@mock.patch('cron.cron.get_cache_backend')
+class CacheBusterTest(TransactionTestCase):
+    def setUp(self):
+        self.query = QueryFactory()
+
+    def make_cache(self, table_name, byte_size, days_old=0, backend='mysql',
+                   query=None):
+        cache = QueryCacheFactory(
+            query=query or self.query, table_name=table_name,
+            byte_size=byte_size, backend=backend,
+            last_access=timezone.now() - relativedelta(days=days_old))
+        # run_time is auto_now so age it with an update
+        website.models.QueryCache.objects.filter(id=cache.id).update(
+            run_time=timezone.now() - relativedelta(days=days_old))
+        return cache
+
+    def remaining(self):
+        return sorted(website.models.QueryCache.objects.values_list(
+            'table_name', flat=True))
+
+    def dropped(self, get_cache_backend):
+        drop_many = get_cache_backend.return_value.drop_many
+        return sorted(t for c in drop_many.call_args_list for t in c[0][0])
+
+    @override_settings(CACHE_TTL=86400, CACHE_STALE_TTL=86400)
+    def test_expired(self, get_cache_backend):
+        self.make_cache('table_old', 10, days_old=3)
+        self.make_cache('table_stale', 10, days_old=1.5)
+        self.make_cache('table_new', 10)
+        self.assertEqual(cron.cache_buster(budget=None), 1)
+        self.assertEqual(self.dropped(get_cache_backend), ['table_old'])
+        self.assertEqual(self.remaining(), ['table_new', 'table_stale'])
+
+    @override_settings(CACHE_TTL=86400, CACHE_STALE_TTL=0)
+    def test_expired_by_query_and_db_ttl(self, get_cache_backend):
+        week = 7 * 86400
+        long_db = DbFactory(name_short='long', name_long='long',
+                            cache_ttl=week)
+        long_query = QueryFactory(title='long', db=long_db)
+        short_query = QueryFactory(title='short', db=long_db, cache_ttl=60)
+        self.make_cache('table_default', 10, days_old=3)
+        self.make_cache('table_long', 10, days_old=3, query=long_query)
+        self.make_cache('table_short', 10, days_old=0.5, query=short_query)
+        cron.cache_buster(budget=None)
+        self.assertEqual(self.dropped(get_cache_backend),
+                         ['table_default', 'table_short'])
+        self.assertEqual(self.remaining(), ['table_long'])
+
+    def test_budget_evicts_least_recently_used(self, get_cache_backend):
+        self.make_cache('table_a', 10, days_old=1)
+        self.make_cache('table_b', 10)
+        self.make_cache('table_c', 10, days_old=1.5)
+        cron.cache_buster(budget=15)
+        self.assertEqual(self.dropped(get_cache_backend),
+                         ['table_a', 'table_c'])
+        self.assertEqual(self.remaining(), ['table_b'])
+
+    def test_batches_by_backend(self, get_cache_backend):
+        for i in range(5):
+            self.make_cache('table_%s' % i, 10, days_old=3,
+                            backend=['mysql', 'file'][i % 2])
+        cron.evict_caches(website.models.QueryCache.objects.values_list(
+            'id', 'table_name', 'backend', 'byte_size'), batch_size=2)
+        self.assertEqual(
+            sorted(c[0][0] for c in get_cache_backend.call_args_list),
+            ['file', 'mysql'])
+        self.assertEqual(get_cache_backend.return_value.drop_many.call_count,
+                         2)
+        self.assertEqual(self.remaining(), [])
+
+
+class CacheWarmerTest(TransactionTestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        db = DbFactory()
+        self.cheap = QueryFactory(title='cheap', db=db, owner=self.user)
+        self.costly = QueryFactory(title='costly', db=db, owner=self.user)
+        self.popular = QueryFactory(title='popular', db=db, owner=self.user)
+
+    def view(self, query, execution_time, count=1, used_cache=False,
+             days_old=0):
+        for i in range(count):
+            view = website.models.QueryView.objects.create(
+                user=self.user, query=query, used_cache=used_cache,
+                execution_time=execution_time)
+            website.models.QueryView.objects.filter(id=view.id).update(
+                view_time=timezone.now() - relativedelta(days=days_old))
+
+    def test_rank_queries(self):
+        self.view(self.cheap, 0.1, count=10)
+        self.view(self.costly, 30.0)
+        self.view(self.popular, 2.0)
+        self.view(self.popular, 0.0, count=9, used_cache=True)
+        # Old views do not count
+        self.view(self.cheap, 0.1, count=100, days_old=30)
+        self.assertEqual(
+            [r[0] for r in cron.rank_queries(lookback_days=7)],
+            [self.costly.id, self.popular.id, self.cheap.id])
+        self.assertEqual(len(cron.rank_queries(limit=1)), 1)
+
+    @mock.patch('cron.cron.website.query.LoadQuery')
+    def test_warm_expiring_caches(self, LoadQuery):
+        self.view(self.costly, 30.0)
+        self.view(self.popular, 2.0)
+        fresh = mock.Mock(cache_run_time=timezone.now())
+        fresh.get_cache_ttl.return_value = (24 * 60 * 60, 0)
+        expiring = mock.Mock(cache_run_time=timezone.now() - relativedelta(
+            hours=23, minutes=30))
+        expiring.get_cache_ttl.return_value = (24 * 60 * 60, 0)
+        LoadQuery.return_value.prepare_query.side_effect = [expiring, fresh]
+        self.assertEqual(cron.cache_warmer(), [self.costly.id])
+        self.assertTrue(expiring.force_refresh)
+        expiring.run_query.assert_called_once_with(
+            write_behind=False, record_view=False)
+        self.assertFalse(fresh.run_query.called)
@@ -0,0 +1,70 @@
+from django.http import Http404
+from django.test import TransactionTestCase
+from taggit.models import Tag
+
+from website import definition_cache
+import website.query
+
+from ..factories import (QueryFactory, QueryDefaultFactory,
+                         QueryPrecedentFactory, UserFactory)
+
+
+class DefinitionCacheTest(TransactionTestCase):
+    def setUp(self):
+        definition_cache.clear()
+        self.query = QueryFactory(tags=['finance'])
+        QueryDefaultFactory(query=self.query, search_for='<A>',
+                            replace_with='1')
+
+    def tearDown(self):
+        definition_cache.clear()
+
+    def test_cached(self):
+        definition = definition_cache.get(self.query.id)
+        self.assertEqual(definition.query_tags, set(['finance']))
+        self.assertEqual(
+            [d.search_for for d in definition.defaults], ['<A>'])
+        with self.assertNumQueries(0):
+            self.assertIs(definition_cache.get(str(self.query.id)),
+                          definition)
+
+    def test_prepare_query_cached(self):
+        lq = website.query.LoadQuery(query_id=self.query.id,
+                                     user=UserFactory(is_superuser=True))
+        lq.prepare_query()
+        with self.assertNumQueries(0):
+            q = lq.prepare_query()
+            q.check_permission()
+            self.assertEqual(q.precedent_graph(), {self.query.id: []})
+
+    def test_invalidated_by_signals(self):
+        definition = definition_cache.get(self.query.id)
+        QueryDefaultFactory(query=self.query, search_for='<B>')
+        self.assertEqual(
+            set(d.search_for for d in definition_cache.get(
+                self.query.id).defaults), set(['<A>', '<B>']))
+        self.query.tags.add('sales')
+        self.assertEqual(definition_cache.get(self.query.id).query_tags,
+                         set(['finance', 'sales']))
+        precedent = QueryFactory(title='precedent', db=self.query.db)
+        QueryPrecedentFactory(final_query=self.query,
+                              preceding_query=precedent)
+        self.assertEqual(
+            definition_cache.get(self.query.id).precedent_ids,
+            [precedent.id])
+        self.query.description = 'changed'
+        self.query.save()
+        definition = definition_cache.get(self.query.id)
+        self.assertEqual(definition.query.description, 'changed')
+
+    def test_tag_rename_invalidates(self):
+        definition_cache.get(self.query.id)
+        tag = Tag.objects.get(name='finance')
+        tag.name = 'sales'
+        tag.save()
+        self.assertEqual(definition_cache.get(self.query.id).query_tags,
+                         set(['sales']))
+
+    def test_missing(self):
+        with self.assertRaises(Http404):
+            definition_cache.get(self.query.id + 1)
@@ -0,0 +1,110 @@
+from unittest import TestCase
+
+from website import fingerprint
+
+
+class TestFingerprint(TestCase):
+    def test_formatting_ignored(self):
+        self.assertEqual(
+            fingerprint.fingerprint('SELECT a\n  FROM t -- all\nWHERE b = 1;'),
+            fingerprint.fingerprint('select a from t /* rows */ where b=1'))
+
+    def test_normalize(self):
+        self.assertEqual(
+            fingerprint.normalize('SELECT  a,b\nFROM t\tWHERE x >= 2 ;;'),
+            'select a,b from t where x >= 2')
+        self.assertEqual(
+            fingerprint.normalize('SELECT  a,b\nFROM t\tWHERE x >= 2 ;;',
+                                  'Postgres'),
+            'select a , b from t where x >= 2')
+
+    def test_mysql_column_labels_kept(self):
+        # MySQL labels unaliased columns with their text as written
+        for a, b in [('select count(*) from t', 'SELECT COUNT(*) FROM t'),
+                     ('select a+b from t', 'select a + b from t'),
+                     ('with x as (select 1) select a+b from x',
+                      'with x as (select 1) select a + b from x'),
+                     ('(select a+b from t) union (select 1 from u)',
+                      '(select a + b from t) union (select 1 from u)')]:
+            self.assertNotEqual(fingerprint.fingerprint(a),
+                                fingerprint.fingerprint(b))
+        self.assertEqual(
+            fingerprint.normalize(
+                'SELECT /* all */ a+b,\n COUNT(*) -- n\n FROM t '
+                'WHERE c IN (SELECT  d FROM u)'),
+            'select a+b,\n COUNT(*) from t where c in ( select d from u )')
+        self.assertEqual(
+            fingerprint.fingerprint('select count(*) from t', 'Postgres'),
+            fingerprint.fingerprint('SELECT COUNT(*) FROM t', 'Postgres'))
+
+    def test_literals_kept(self):
+        self.assertNotEqual(
+            fingerprint.fingerprint("select * from t where a = 'X'"),
+            fingerprint.fingerprint("select * from t where a = 'x'"))
+        self.assertEqual(
+            fingerprint.normalize("SELECT 'a  -- b'  FROM t"),
+            "select 'a  -- b' from t")
+
+    def test_identifier_case_kept(self):
+        self.assertNotEqual(
+            fingerprint.fingerprint('select * from Users'),
+            fingerprint.fingerprint('select * from users'))
+
+    def test_hints_kept(self):
+        self.assertEqual(
+            fingerprint.normalize('SELECT /*+ MAX_EXECUTION_TIME(1) */ 1'),
+            'select /*+ MAX_EXECUTION_TIME(1) */ 1')
+
+    def test_mysql_comments_and_escapes(self):
+        self.assertEqual(
+            fingerprint.normalize("select 'it\\'s # not' # comment"),
+            "select 'it\\'s # not'")
+        self.assertEqual(
+            fingerprint.normalize('select `a  b` from t'),
+            'select `a  b` from t')
+
+    def test_postgres(self):
+        self.assertEqual(
+            fingerprint.normalize("SELECT 'a\\' # b", 'Postgres'),
+            "select 'a\\' # b")
+        self.assertEqual(
+            fingerprint.normalize('SELECT x::date FROM t', 'Postgres'),
+            'select x :: date from t')
+
+    def test_mysql_double_dash(self):
+        self.assertNotEqual(
+            fingerprint.fingerprint('select a from t where b = 5--1'),
+            fingerprint.fingerprint('select a from t where b = 5'))
+        self.assertEqual(
+            fingerprint.normalize('select a from t where b = 5--1'),
+            'select a from t where b = 5 - - 1')
+        self.assertEqual(
+            fingerprint.normalize('select a from t where b in (5 --\t1\n)'),
+            'select a from t where b in ( 5 )')
+        self.assertEqual(fingerprint.normalize('select 5--'), 'select 5')
+
+    def test_postgres_dollar_quoted(self):
+        self.assertNotEqual(
+            fingerprint.fingerprint('select $$a  b$$', 'Postgres'),
+            fingerprint.fingerprint('select $$a b$$', 'Postgres'))
+        self.assertEqual(
+            fingerprint.normalize("SELECT $f$it's -- $$ $f$ FROM t",
+                                  'Postgres'),
+            "select $f$it's -- $$ $f$ from t")
+        self.assertEqual(
+            fingerprint.normalize('SELECT a FROM t WHERE b = $1', 'Postgres'),
+            'select a from t where b = $ 1')
+
+    def test_postgres_escape_strings(self):
+        self.assertNotEqual(
+            fingerprint.fingerprint("select E'a  b'", 'Postgres'),
+            fingerprint.fingerprint("select E'a b'", 'Postgres'))
+        self.assertEqual(
+            fingerprint.normalize("SELECT e'it\\'s -- x'  FROM t",
+                                  'Postgres'),
+            "select e'it\\'s -- x' from t")
+
+    def test_unicode(self):
+        self.assertEqual(
+            fingerprint.fingerprint(u"select '\xe9'"),
+            fingerprint.fingerprint(u"SELECT '\xe9'"))
@@ -0,0 +1,30 @@
+from unittest import TestCase
+import mock
+
+from website import jobs
+
+
+@mock.patch('website.jobs.get_job_pool')
+class TestRefreshCache(TestCase):
+    def run_query(self):
+        return mock.Mock(query_id=1, query_hash='h', parameters={'a': '1'})
+
+    def tearDown(self):
+        jobs._refreshing.clear()
+
+    def test_one_refresh_at_a_time(self, get_job_pool):
+        self.assertTrue(jobs.refresh_cache(self.run_query()))
+        self.assertFalse(jobs.refresh_cache(self.run_query()))
+        self.assertEqual(get_job_pool.return_value.apply_async.call_count, 1)
+
+    @mock.patch('website.jobs.connection')
+    @mock.patch('website.jobs.query.LoadQuery')
+    def test_refresh_skips_cache(self, LoadQuery, connection, get_job_pool):
+        jobs.refresh_cache(self.run_query())
+        args = get_job_pool.return_value.apply_async.call_args[0][1]
+        jobs.run_refresh(*args)
+        self.assertTrue(LoadQuery.call_args[1]['force_refresh'])
+        LoadQuery.return_value.prepare_query.return_value.run_query.\
+            assert_called_once_with(write_behind=False, record_view=False)
+        # A new refresh can be queued once this one finished
+        self.assertTrue(jobs.refresh_cache(self.run_query()))
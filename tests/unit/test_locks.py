@@ -0,0 +1,61 @@
+from unittest import TestCase
+import mock
+
+from website import locks
+
+
+class TestAdvisoryLock(TestCase):
+    def mock_connection(self, dialect, result):
+        connection = mock.Mock()
+        connection.dialect.name = dialect
+        connection.execute.return_value.scalar.return_value = result
+        engine = mock.Mock()
+        engine.connect.return_value = connection
+        patcher = mock.patch('website.get_db_engine.get_lock_engine',
+                             return_value=engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return connection
+
+    def executed(self, connection):
+        return [str(c[0][0]) for c in connection.execute.call_args_list]
+
+    def test_mysql_lock(self):
+        connection = self.mock_connection('mysql', 1)
+        with locks.AdvisoryLock('name', timeout=5) as lock:
+            self.assertTrue(lock.acquired)
+            self.assertFalse(connection.close.called)
+        self.assertEqual(self.executed(connection), [
+            'SELECT GET_LOCK(:name, :timeout)',
+            'SELECT RELEASE_LOCK(:name)'])
+        self.assertTrue(connection.close.called)
+
+    def test_mysql_timeout(self):
+        connection = self.mock_connection('mysql', 0)
+        lock = locks.AdvisoryLock('name', timeout=5)
+        self.assertFalse(lock.acquire())
+        self.assertTrue(connection.close.called)
+        lock.release()
+        self.assertEqual(len(self.executed(connection)), 1)
+
+    def test_postgres_lock(self):
+        connection = self.mock_connection('postgresql', True)
+        with locks.AdvisoryLock('name', timeout=5) as lock:
+            self.assertTrue(lock.acquired)
+        self.assertEqual(self.executed(connection), [
+            'SELECT pg_try_advisory_lock(hashtext(:name))',
+            'SELECT pg_advisory_unlock(hashtext(:name))'])
+
+    def test_postgres_timeout(self):
+        self.mock_connection('postgresql', False)
+        self.assertFalse(locks.AdvisoryLock('name', timeout=0).acquire())
+
+    def test_connect_failure_not_taken(self):
+        engine = mock.Mock()
+        engine.connect.side_effect = Exception('QueuePool limit reached')
+        with mock.patch('website.get_db_engine.get_lock_engine',
+                        return_value=engine):
+            lock = locks.AdvisoryLock('name', timeout=5)
+            self.assertFalse(lock.acquire())
+        self.assertIsNone(lock.connection)
+        lock.release()
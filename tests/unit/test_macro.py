@@ -1,6 +1,7 @@
 from unittest import TestCase
 from datetime import date, timedelta
-from website.macro import Macro, DateMacro  # , TableMacro
+from website import macro as macro_module
+from website.macro import Macro, DateMacro, TableMacro, MacroTemplate
 
 
 class TestMacro(TestCase):
@@ -23,3 +24,94 @@ class TestMacro(TestCase):
                 d2=date.today() + timedelta(days=-1)
             )
         )
+
+    def test_earliest(self):
+        macro = DateMacro()
+        self.assertEqual(
+            macro.earliest("a >= <DATEID-90> and a < <DATEID> or <DATEID-7>"),
+            ('<DATEID-90>', date.today() + timedelta(days=-90)))
+        self.assertIsNone(macro.earliest("no macros"))
+
+    def test_date_regex_characters(self):
+        self.assertEqual(
+            DateMacro().replace_text("a.b* <DATEID> (x)"),
+            "a.b* {d} (x)".format(d=date.today()))
+
+    def test_table(self):
+        macro = TableMacro()
+        self.assertEqual(
+            macro.replace_text("<TABLE-1> join <TABLE-12> on <TABLE-1>",
+                               {1: 'table_1_g', 12: 'table_12_g'}),
+            "table_1_g join table_12_g on table_1_g")
+
+
+class TestMacroTemplate(TestCase):
+    def test_render(self):
+        template = MacroTemplate(
+            "select * from <TABLE-3> where a = '<A>' and b = <AB> "
+            "and d >= <DATEID-2>", ['<A>', '<AB>'])
+        self.assertEqual(
+            template.render({'<A>': 'x', '<AB>': '<DATEID>'}),
+            "select * from <TABLE-3> where a = 'x' and b = {d1} "
+            "and d >= {d2}".format(
+                d1=date.today(), d2=date.today() + timedelta(days=-2)))
+        self.assertEqual(
+            template.render({'<A>': 'x', '<AB>': '<DATEID>'}, dates=False,
+                            table_id_dict={3: 'table_3_g'}),
+            "select * from table_3_g where a = 'x' and b = <DATEID> "
+            "and d >= <DATEID-2>")
+
+    def test_values_not_rescanned(self):
+        template = MacroTemplate("<A> <B>", ['<A>', '<B>'])
+        self.assertEqual(template.render({'<A>': '<B>', '<B>': 'b'}),
+                         "<B> b")
+
+    def test_render_bound(self):
+        template = MacroTemplate(
+            "select '%' from t where a = '<A>' and b like '%<A>%' "
+            "and c = <N> and d >= <DATEID>", ['<A>', '<N>'])
+        self.assertEqual(
+            template.render_bound({'<A>': u'x', '<N>': 5}),
+            (u"select '%%' from t where a = %s and b like '%%x%%' "
+             u"and c = %s and d >= {d}".format(d=date.today()), [u'x', 5]))
+
+    def test_render_bound_comments(self):
+        template = MacroTemplate(
+            "select 1 -- don't touch <A>\nfrom t where a = '<A>' "
+            "/* it's '<A>' */", ['<A>'])
+        self.assertEqual(
+            template.render_bound({'<A>': u'x'}),
+            (u"select 1 -- don't touch x\nfrom t where a = %s "
+             u"/* it's 'x' */", [u'x']))
+
+    def test_render_bound_escaped_quotes(self):
+        template = MacroTemplate(
+            "select * from t where b = 'it\\'s' and a = '<A>' "
+            "and c = 'say ''<A>'''", ['<A>'])
+        self.assertEqual(
+            template.render_bound({'<A>': u'x'}),
+            (u"select * from t where b = 'it\\'s' and a = %s "
+             u"and c = 'say ''x'''", [u'x']))
+
+    def test_render_bound_double_quotes(self):
+        template = MacroTemplate('select * from t where a = "<A>"', ['<A>'])
+        self.assertEqual(
+            template.render_bound({'<A>': u'x'}),
+            (u'select * from t where a = %s', [u'x']))
+        # Postgres double quotes are identifiers, E'' strings are strings
+        template = MacroTemplate(
+            """select "<A>" from t where a = E'<A>'""", ['<A>'])
+        self.assertEqual(
+            template.render_bound({'<A>': u'x'}, db_type='Postgres'),
+            (u'select "x" from t where a = %s', [u'x']))
+
+    def test_no_placeholders(self):
+        self.assertEqual(MacroTemplate("select 1").render(), "select 1")
+        self.assertEqual(MacroTemplate("").render(), "")
+
+    def test_get_template_cached(self):
+        template = macro_module.get_template((1, 't'), "<A>", ['<A>'])
+        self.assertIs(
+            macro_module.get_template((1, 't'), "<A>", ['<A>']), template)
+        self.assertIsNot(
+            macro_module.get_template((1, 't2'), "<A>", ['<A>']), template)
@@ -0,0 +1,58 @@
+from unittest import TestCase
+from datetime import datetime
+import gzip
+import mock
+from StringIO import StringIO
+
+from website import payload_cache
+
+
+def identity(query_id=1, table_name='table_1_h', fmt='array'):
+    return (query_id, 'h', table_name, datetime(2015, 1, 1), False, False,
+            datetime(2015, 1, 1), fmt)
+
+
+class TestPayloadCache(TestCase):
+    def setUp(self):
+        payload_cache.clear()
+        patcher = mock.patch.object(
+            payload_cache, 'get_budget', return_value=100000)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        payload_cache.clear()
+
+    def test_hit(self):
+        payload_cache.put(identity(), '{"data": 1}')
+        self.assertEqual(payload_cache.get(identity()), ('{"data": 1}', None))
+        self.assertIsNone(payload_cache.get(identity(fmt='columnar')))
+
+    def test_etag(self):
+        self.assertEqual(payload_cache.etag(identity()),
+                         payload_cache.etag(identity()))
+        self.assertNotEqual(payload_cache.etag(identity()),
+                            payload_cache.etag(identity(fmt='columnar')))
+
+    def test_gzip_large_bodies(self):
+        body = '{"data": "%s"}' % ('x' * 2000)
+        gzipped = payload_cache.put(identity(), body)[1]
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(gzipped)).read(),
+                         body)
+
+    def test_invalidate_table(self):
+        payload_cache.put(identity(), '{}')
+        payload_cache.put(identity(2, 'table_2_h'), '{}')
+        payload_cache.invalidate_table('table_1_h')
+        self.assertIsNone(payload_cache.get(identity()))
+        self.assertIsNotNone(payload_cache.get(identity(2, 'table_2_h')))
+        self.assertEqual(payload_cache._total_bytes, 2)
+
+    def test_least_recently_used_evicted(self):
+        payload_cache.get_budget.return_value = 20
+        payload_cache.put(identity(1), 'x' * 10)
+        payload_cache.put(identity(2), 'x' * 10)
+        payload_cache.get(identity(1))
+        payload_cache.put(identity(3), 'x' * 10)
+        self.assertIsNotNone(payload_cache.get(identity(1)))
+        self.assertIsNone(payload_cache.get(identity(2)))
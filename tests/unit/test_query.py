@@ -2,6 +2,12 @@ from unittest import TestCase
 import website.query
 import pandas as pd
 import json
+import mock
+import math
+import decimal
+import datetime
+import website.models
+from django.utils import timezone
 
 
 class TestLimits(TestCase):
@@ -81,3 +87,512 @@ class TestManipulateData(TestCase):
                 "summer": {"0": 0.0, "1": 1.0, "2": 2.0},
                 "winter": {"0": 4.0, "1": 3.0, "2": 0.0}
             })
+
+
+class FakeCursor(object):
+    description = [('a', None), ('b', None)]
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query_text):
+        self.query_text = query_text
+
+    def fetchmany(self, size):
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        return chunk
+
+    def close(self):
+        pass
+
+
+class TestStreaming(TestCase):
+    def run_streaming(self, rows, db_type='MySQL'):
+        db = mock.Mock(type=db_type, statement_timeout=None)
+        md = website.query.ManipulateData(
+            query_text='select a, b from t', db=db, stream=True)
+        connection = mock.Mock(info={})
+        connection.cursor.return_value = FakeCursor(rows)
+        engine = mock.Mock()
+        engine.raw_connection.return_value = connection
+        with mock.patch('website.get_db_engine.get_source_engine',
+                        return_value=engine):
+            df = md.run_sql_query_streaming(chunk_size=2)
+        self.assertTrue(connection.close.called)
+        return df, connection
+
+    def test_chunks_combined(self):
+        rows = [(i, 'x%s' % i) for i in range(5)]
+        df, connection = self.run_streaming(rows)
+        self.assertEqual(df.columns.tolist(), ['a', 'b'])
+        self.assertEqual(df['a'].tolist(), range(5))
+        self.assertEqual(df['b'].tolist()[-1], 'x4')
+
+    def test_postgres_named_cursor(self):
+        df, connection = self.run_streaming([(1, 'a')], 'Postgres')
+        self.assertIn('name', connection.cursor.call_args[1])
+
+    def test_no_rows(self):
+        self.assertRaises(Exception, self.run_streaming, [])
+
+
+class TestStatementTimeout(TestCase):
+    def run_query(self, db_type='MySQL', db_timeout=None, query_timeout=None):
+        db = mock.Mock(type=db_type, statement_timeout=db_timeout)
+        query_model = mock.Mock(statement_timeout=query_timeout)
+        return website.query.RunQuery(
+            query_text='', db=db, query_model=query_model)
+
+    def set_timeout(self, rq, info=None):
+        connection = mock.Mock(info=info if info is not None else {})
+        cursor = connection.cursor.return_value
+        rq.set_statement_timeout(connection)
+        return connection, cursor
+
+    def test_query_overrides_db(self):
+        self.assertEqual(self.run_query(db_timeout=10).get_statement_timeout(),
+                         10)
+        self.assertEqual(
+            self.run_query(db_timeout=10, query_timeout=5)
+            .get_statement_timeout(), 5)
+
+    def test_mysql(self):
+        connection, cursor = self.set_timeout(self.run_query(db_timeout=30))
+        cursor.execute.assert_called_once_with(
+            'SET SESSION max_execution_time = 30000')
+        self.assertEqual(connection.info['statement_timeout'], 30)
+
+    def test_postgres_commits(self):
+        connection, cursor = self.set_timeout(
+            self.run_query('Postgres', query_timeout=2))
+        cursor.execute.assert_called_once_with('SET statement_timeout = 2000')
+        self.assertTrue(connection.commit.called)
+
+    def test_unchanged_timeout_skipped(self):
+        connection, cursor = self.set_timeout(
+            self.run_query(db_timeout=30), {'statement_timeout': 30})
+        self.assertFalse(cursor.execute.called)
+
+    def test_no_timeout_skipped(self):
+        connection, cursor = self.set_timeout(self.run_query())
+        self.assertFalse(cursor.execute.called)
+
+    def test_cleared_timeout_reset(self):
+        connection, cursor = self.set_timeout(
+            self.run_query(), {'statement_timeout': 30})
+        cursor.execute.assert_called_once_with(
+            'SET SESSION max_execution_time = 0')
+
+
+class TestCancel(TestCase):
+    def cancel(self, db_type, rows, all_users=False):
+        db = mock.Mock(type=db_type)
+        rq = website.query.RunQuery(
+            query_text='', db=db, query_id=7, user=mock.Mock(id=3))
+        c = mock.Mock()
+        c.execute.return_value.fetchall.return_value = rows
+        c.execute.return_value.__iter__ = lambda self: iter(rows)
+        engine = mock.Mock()
+        engine.connect.return_value = c
+        with mock.patch('website.get_db_engine.get_source_engine',
+                        return_value=engine):
+            cancelled = rq.cancel(all_users)
+        self.assertTrue(c.close.called)
+        return cancelled, c
+
+    def test_mysql_kills_tagged_queries(self):
+        cancelled, c = self.cancel('MySQL', [(11,), (12,)])
+        self.assertEqual(cancelled, 2)
+        self.assertEqual(c.execute.call_args_list[0][1]['pattern'],
+                         '%sqlviz Running Query Id: 7 User: 3 %')
+        c.execute.assert_any_call('KILL QUERY 11')
+        c.execute.assert_any_call('KILL QUERY 12')
+
+    def test_postgres_all_users(self):
+        cancelled, c = self.cancel('Postgres', [(True,)], all_users=True)
+        self.assertEqual(cancelled, 1)
+        self.assertEqual(c.execute.call_args[1]['pattern'],
+                         '%sqlviz Running Query Id: 7 User: %')
+
+    def test_comment_matches_cancel_tag(self):
+        rq = website.query.RunQuery(
+            query_text='select 1', db=mock.Mock(type='MySQL'), query_id=7,
+            user=mock.Mock(id=3))
+        rq.add_comment()
+        self.assertIn('sqlviz Running Query Id: 7 User: 3 ', rq.query_text)
+
+
+class TestCacheTtl(TestCase):
+    def run_query(self, db_ttl=None, query_ttl=None, stale_ttl=None):
+        db = mock.Mock(cache_ttl=db_ttl, cache_stale_ttl=None)
+        query_model = mock.Mock(cache_ttl=query_ttl, cache_stale_ttl=stale_ttl)
+        rq = website.query.RunQuery(
+            query_text='', db=db, query_id=1, query_model=query_model)
+        rq.query_hash = 'h'
+        return rq
+
+    def test_ttl_precedence(self):
+        with mock.patch('website.query.settings') as settings:
+            settings.CACHE_TTL = 100
+            settings.CACHE_STALE_TTL = 0
+            self.assertEqual(self.run_query().get_cache_ttl(), (100, 0))
+            self.assertEqual(
+                self.run_query(db_ttl=60).get_cache_ttl(), (60, 0))
+            self.assertEqual(
+                self.run_query(db_ttl=60, query_ttl=0, stale_ttl=30)
+                .get_cache_ttl(), (0, 30))
+
+    def check_cache(self, age, allow_stale=True):
+        rq = self.run_query(query_ttl=60, stale_ttl=60)
+        qc = website.models.QueryCache(
+            id=5, table_name='table_1_h', backend='mysql',
+            run_time=timezone.now() - datetime.timedelta(seconds=age))
+        with mock.patch('website.models.QueryCache.objects') as objects:
+            objects.filter.return_value.order_by.return_value.first.\
+                return_value = qc
+            return rq.check_cache(allow_stale), rq.cache_stale
+
+    def test_fresh(self):
+        self.assertEqual(self.check_cache(30), ('table_1_h', False))
+
+    def test_stale(self):
+        self.assertEqual(self.check_cache(90), ('table_1_h', True))
+        self.assertEqual(self.check_cache(90, allow_stale=False)[0], False)
+
+    def test_expired(self):
+        self.assertEqual(self.check_cache(150)[0], False)
+
+
+class TestRunPrecedent(TestCase):
+    def run_precedent(self, backend):
+        rq = website.query.RunQuery(
+            query_text='', db=mock.Mock(), query_id=2, query_model=mock.Mock())
+        q = mock.Mock(cached=True, slice_filters=[],
+                      cache_backend_name=backend)
+        q.check_cache.return_value = 'table_1_h'
+        with mock.patch('website.query.LoadQuery') as LoadQuery:
+            LoadQuery.return_value.prepare_query.return_value = q
+            LoadQuery.return_value.query_id = 1
+            result = rq.run_precedent(1, mock.Mock(guid='g'))
+        return result, q
+
+    def test_mysql_cache_reused(self):
+        result, q = self.run_precedent('mysql')
+        self.assertEqual(result, (1, 'table_1_h'))
+        self.assertFalse(q.save_to_mysql.called)
+
+    def test_file_cache_saved_to_mysql(self):
+        result, q = self.run_precedent('file')
+        self.assertEqual(result, (1, 'table_1_g'))
+        q.save_to_mysql.assert_called_with('table_1_g', backend='mysql')
+
+
+class TestIncremental(TestCase):
+    def setUp(self):
+        self.today = datetime.date.today()
+
+    def day(self, days_back):
+        return self.today - datetime.timedelta(days=days_back)
+
+    def run_incremental(self, cached, new, error=None):
+        query_model = mock.Mock(incremental_column='dt', insert_limit=False)
+        rq = website.query.RunQuery(
+            query_text='', db=mock.Mock(type='MySQL'), query_id=1,
+            query_model=query_model)
+        rq.window_template = 'select * from t where dt >= <DATEID-2>'
+        rq.template_hash = 't'
+        base = website.models.QueryCache(table_name='table_1_old')
+        storage = mock.Mock()
+        storage.load.return_value = cached
+        with mock.patch.object(rq, 'incremental_base', return_value=base), \
+                mock.patch('website.cache_backend.get_cache_backend',
+                           return_value=storage), \
+                mock.patch.object(rq, 'run_sql_query', return_value=new,
+                                  side_effect=error) as run_sql_query:
+            data = rq.run_incremental()
+        return data, run_sql_query
+
+    def test_append_and_trim(self):
+        cached = pd.DataFrame({'dt': [self.day(3), self.day(2), self.day(1)],
+                               'n': [1, 2, 3]})
+        new = pd.DataFrame({'dt': [self.day(1), self.day(0)], 'n': [4, 5]})
+        data, run_sql_query = self.run_incremental(cached, new)
+        self.assertEqual(data['n'].tolist(), [2, 4, 5])
+        self.assertTrue(run_sql_query.called)
+
+    def test_query_text(self):
+        rq = website.query.RunQuery(
+            query_text='select 1', db=mock.Mock(type='Postgres'), query_id=1,
+            query_model=mock.Mock(insert_limit=True))
+        rq.window_template = 'select * from t where dt >= <DATEID-7> ' \
+                             'and dt < <DATEID>'
+        self.assertIn(
+            "dt >= %s and dt < %s limit 1000;" % (self.day(3), self.today),
+            rq.incremental_query_text(self.day(3)))
+        self.assertEqual(rq.query_text, 'select 1')
+
+    def test_descending(self):
+        cached = pd.DataFrame({'dt': [self.day(1), self.day(2)], 'n': [2, 1]})
+        new = pd.DataFrame({'dt': [self.day(0), self.day(1)], 'n': [4, 3]})
+        data, _ = self.run_incremental(cached, new)
+        self.assertEqual(data['n'].tolist(), [4, 3, 1])
+
+    def test_outside_window_runs_in_full(self):
+        cached = pd.DataFrame({'dt': [self.day(5)], 'n': [1]})
+        data, run_sql_query = self.run_incremental(cached, None)
+        self.assertIsNone(data)
+        self.assertFalse(run_sql_query.called)
+
+    def test_no_new_rows(self):
+        cached = pd.DataFrame({'dt': [self.day(3), self.day(1)], 'n': [1, 2]})
+        data, _ = self.run_incremental(
+            cached, None, website.query.NoDataError('No Data'))
+        self.assertEqual(data['n'].tolist(), [2])
+
+    def run_query(self, **kwargs):
+        rq = website.query.RunQuery(
+            query_text='select 1', db=mock.Mock(type='MySQL'), query_id=1,
+            query_model=mock.Mock(), **kwargs)
+        rq.query_hash = 'h'
+        new = pd.DataFrame({'n': [1]})
+        with mock.patch.multiple(
+                rq, prepare_safety=mock.DEFAULT, check_permission=mock.DEFAULT,
+                save_to_mysql=mock.DEFAULT, run_incremental=mock.DEFAULT,
+                run_precedents=mock.Mock(return_value={}),
+                check_cache=mock.Mock(return_value=False),
+                run_sql_query=mock.Mock(return_value=new)) as patched, \
+                mock.patch('website.locks.AdvisoryLock'):
+            patched['run_incremental'].return_value = None
+            rq.run_query(write_behind=False, record_view=False)
+        return patched['run_incremental']
+
+    def test_only_cached_runs_incremental(self):
+        self.assertTrue(self.run_query().called)
+        self.assertFalse(self.run_query(cacheable=False).called)
+        self.assertFalse(self.run_query(force_refresh=True).called)
+
+    def test_changed_columns_run_in_full(self):
+        cached = pd.DataFrame({'dt': [self.day(1)], 'n': [1]})
+        new = pd.DataFrame({'dt': [self.day(0)], 'm': [1]})
+        self.assertIsNone(self.run_incremental(cached, new)[0])
+
+
+class TestPayloadIdentity(TestCase):
+    def run_query(self, **kwargs):
+        query_model = mock.Mock(
+            pivot_data=True, cumulative=False, insert_limit=True,
+            modified_time=datetime.datetime(2015, 1, 1))
+        rq = website.query.RunQuery(
+            query_text='select 1', db=mock.Mock(type='MySQL'), query_id=1,
+            query_model=query_model, **kwargs)
+        rq.prepare_safety()
+        return rq
+
+    def test_prepare_safety_once(self):
+        rq = self.run_query()
+        query_text = rq.query_text
+        rq.prepare_safety()
+        self.assertEqual(rq.query_text, query_text)
+        self.assertEqual(rq.query_text.count('limit 1000'), 1)
+
+    def test_identity(self):
+        rq = self.run_query()
+        run_time = datetime.datetime(2015, 1, 2)
+
+        def check_cache():
+            rq.cache_run_time = run_time
+            return 'table_1_h'
+        with mock.patch.object(rq, 'check_cache', check_cache):
+            self.assertEqual(rq.payload_identity('columnar'), (
+                1, rq.query_hash, 'table_1_h', run_time, True, False,
+                datetime.datetime(2015, 1, 1), (), 'columnar'))
+            rq.slice_filters = [('region', 'String', u'EU')]
+            self.assertEqual(rq.payload_identity()[-2:], (
+                (('region', 'String', u'EU'),), 'array'))
+
+    def test_no_identity(self):
+        rq = self.run_query(force_refresh=True)
+        self.assertIsNone(rq.payload_identity())
+        rq = self.run_query(cacheable=False)
+        self.assertIsNone(rq.payload_identity())
+        rq = self.run_query()
+        with mock.patch.object(rq, 'check_cache', return_value=False):
+            self.assertIsNone(rq.payload_identity())
+
+
+class TestSliceData(TestCase):
+    def slice_data(self, slice_filters):
+        rq = website.query.RunQuery(query_text='', db=None)
+        rq.data = pd.DataFrame({
+            'region': ['EU', 'US', 'EU'],
+            'n': [1, 2, 3],
+            'dt': ['2015-01-01', '2015-01-01', '2015-01-02']})
+        rq.slice_filters = slice_filters
+        return rq.slice_data()
+
+    def test_no_filters(self):
+        self.assertEqual(len(self.slice_data([])), 3)
+
+    def test_filters(self):
+        data = self.slice_data([('region', 'String', u'EU')])
+        self.assertEqual(data['n'].tolist(), [1, 3])
+        self.assertEqual(data.index.tolist(), [0, 1])
+        data = self.slice_data([('n', 'Numeric', u'2.0')])
+        self.assertEqual(data['region'].tolist(), ['US'])
+        data = self.slice_data([('region', 'String', u'EU'),
+                                ('dt', 'Date', u'2015-01-02')])
+        self.assertEqual(data['n'].tolist(), [3])
+
+    def test_parameters_replace(self):
+        lq = website.query.LoadQuery(query_id=1, user=None)
+        lq.query = website.query.RunQuery(
+            query_text="select * from t where n = <N>", db=None,
+            query_model=mock.Mock(incremental_column='',
+                                  bind_parameters=False))
+        lq.target_parameters = {
+            '<N>': {'search_for': '<N>', 'replace_with': 2,
+                    'data_type': 'Numeric', 'filter_column': ''},
+            '<REGION>': {'search_for': '<REGION>', 'replace_with': 'EU',
+                         'data_type': 'String', 'filter_column': 'region'},
+            '<CITY>': {'search_for': '<CITY>', 'replace_with': '',
+                       'data_type': 'String', 'filter_column': 'city'}}
+        lq.parameters_replace()
+        self.assertEqual(lq.query.query_text, "select * from t where n = 2")
+        self.assertEqual(lq.query.slice_filters,
+                         [('region', 'String', u'EU')])
+
+
+class TestBindParameters(TestCase):
+    def load_query(self, query_text, target_parameters):
+        lq = website.query.LoadQuery(query_id=1, user=None)
+        lq.query = website.query.RunQuery(
+            query_text=query_text, db=mock.Mock(type='Postgres'),
+            query_model=mock.Mock(incremental_column='',
+                                  bind_parameters=True))
+        lq.target_parameters = target_parameters
+        lq.parameters_replace()
+        return lq.query
+
+    def test_parameters_bound(self):
+        rq = self.load_query(
+            "select '%' from t where n = <N> and r = '<R>'", {
+                '<N>': {'search_for': '<N>', 'replace_with': '2',
+                        'data_type': 'Numeric', 'filter_column': ''},
+                '<R>': {'search_for': '<R>', 'replace_with': 'EU',
+                        'data_type': 'String', 'filter_column': ''}})
+        self.assertEqual(rq.query_text,
+                         "select '%%' from t where n = %s and r = %s")
+        self.assertEqual(rq.bind_values, [2, u'EU'])
+
+    def test_values_in_hash(self):
+        hashes = set()
+        for value in ['EU', 'US']:
+            rq = self.load_query("select * from t where r = '<R>'", {
+                '<R>': {'search_for': '<R>', 'replace_with': value,
+                        'data_type': 'String', 'filter_column': ''}})
+            hashes.add(rq.run_query_hash())
+        self.assertEqual(len(hashes), 2)
+
+    def test_no_parameters_not_bound(self):
+        rq = self.load_query("select '%' from t", {})
+        self.assertEqual(rq.query_text, "select '%' from t")
+        self.assertIsNone(rq.bind_values)
+
+    def test_numbered_placeholders(self):
+        self.assertEqual(
+            website.query.numbered_placeholders(
+                "select '%%' where a = %s and b = %s"),
+            "select '%' where a = $1 and b = $2")
+
+    def bound_statement(self, db_type, info):
+        rq = website.query.RunQuery(
+            query_text='-- sqlviz Running Query Id: 1 User: 2 \n '
+                       'select * from t where a = %s',
+            db=mock.Mock(type=db_type))
+        rq.bind_values = [u'x']
+        connection = mock.Mock(info=info)
+        return rq.bound_statement(connection), connection
+
+    def test_postgres_prepared_once(self):
+        info = {}
+        (statement, values), connection = self.bound_statement(
+            'Postgres', info)
+        self.assertEqual(values, (u'x',))
+        self.assertTrue(statement.startswith(
+            '-- sqlviz Running Query Id: 1 User: 2 \n EXECUTE sqlviz_'))
+        self.assertTrue(statement.endswith(' (%s)'))
+        prepare = connection.cursor.return_value.execute.call_args[0][0]
+        self.assertTrue(prepare.startswith('PREPARE sqlviz_'))
+        self.assertTrue(prepare.endswith('select * from t where a = $1'))
+        self.assertTrue(connection.commit.called)
+        (again, _), connection = self.bound_statement('Postgres', info)
+        self.assertEqual(again, statement)
+        self.assertFalse(connection.cursor.called)
+
+    def test_mysql_client_side(self):
+        (statement, values), connection = self.bound_statement('MySQL', {})
+        self.assertTrue(statement.endswith('select * from t where a = %s'))
+        self.assertEqual(values, (u'x',))
+        self.assertFalse(connection.cursor.called)
+
+
+class TestPandasToArray(TestCase):
+    def test_types(self):
+        md = website.query.ManipulateData(query_text='', db='')
+        md.data = pd.DataFrame({
+            'a': [1, 2],
+            'b': [1.5, None],
+            'c': ['x', None],
+            'd': pd.to_datetime(['2015-01-02', None]),
+            'e': [decimal.Decimal('1.25'), None]},
+            columns=['a', 'b', 'c', 'd', 'e'])
+        data_array = md.pandas_to_array()
+        self.assertEqual(data_array[0], ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(
+            data_array[1],
+            [1, 1.5, 'x', datetime.datetime(2015, 1, 2), 1.25])
+        self.assertEqual(data_array[2][0], 2)
+        self.assertTrue(math.isnan(data_array[2][1]))
+        self.assertEqual(data_array[2][2:], [None, None, None])
+        self.assertIsInstance(data_array[1][0], int)
+
+    def test_empty(self):
+        md = website.query.ManipulateData(query_text='', db='')
+        md.data = pd.DataFrame({'a': []})
+        self.assertEqual(md.pandas_to_array(), [['a']])
+
+
+class TestPandasToColumns(TestCase):
+    def test_columns(self):
+        md = website.query.ManipulateData(query_text='', db='')
+        md.data = pd.DataFrame({
+            'a': [1, 2],
+            'b': ['x', 'y'],
+            'c': [datetime.date(2015, 1, 2), None]},
+            columns=['a', 'b', 'c'])
+        self.assertEqual(md.pandas_to_columns(), {
+            'columns': ['a', 'b', 'c'],
+            'dtypes': ['integer', 'string', 'date'],
+            'data': [[1, 2], ['x', 'y'], [datetime.date(2015, 1, 2), None]]
+        })
+
+
+class TestPrecedentLevels(TestCase):
+    def run_query(self):
+        return website.query.RunQuery(query_text='', db='', query_id='1')
+
+    def test_shared_precedent_runs_once(self):
+        # 1 depends on 2 and 3 which both depend on 4
+        graph = {1: [2, 3], 2: [4], 3: [4], 4: []}
+        levels = self.run_query().precedent_levels(graph)
+        self.assertEqual(levels[0], [4])
+        self.assertEqual(sorted(levels[1]), [2, 3])
+        self.assertEqual(len(levels), 2)
+
+    def test_no_precedents(self):
+        self.assertEqual(self.run_query().precedent_levels({1: []}), [])
+
+    def test_cycle(self):
+        graph = {1: [2], 2: [3], 3: [2]}
+        self.assertRaises(
+            ValueError, self.run_query().precedent_levels, graph)
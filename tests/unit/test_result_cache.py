@@ -0,0 +1,77 @@
+from unittest import TestCase
+from datetime import datetime
+import pandas as pd
+import mock
+
+from website import result_cache
+
+RUN_TIME = datetime(2015, 1, 1)
+
+
+def frame(rows=10):
+    return pd.DataFrame({'a': range(rows), 'b': [1.5] * rows})
+
+
+class TestResultCache(TestCase):
+    def setUp(self):
+        result_cache.clear()
+        patcher = mock.patch.object(
+            result_cache, 'get_budget', return_value=10000)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        result_cache.clear()
+
+    def test_hit(self):
+        result_cache.put(1, 'h', 'table_1_h', RUN_TIME, frame())
+        data = result_cache.get(1, 'h', 'table_1_h', RUN_TIME)
+        self.assertEqual(data['a'].tolist(), range(10))
+
+    def test_returns_copy(self):
+        result_cache.put(1, 'h', 'table_1_h', RUN_TIME, frame())
+        result_cache.get(1, 'h', 'table_1_h', RUN_TIME)['a'] = 0
+        data = result_cache.get(1, 'h', 'table_1_h', RUN_TIME)
+        self.assertEqual(data['a'].tolist(), range(10))
+
+    def test_replaced_table_misses(self):
+        result_cache.put(1, 'h', 'table_1_h', RUN_TIME, frame())
+        self.assertIsNone(
+            result_cache.get(1, 'h', 'table_1_h', datetime(2015, 1, 2)))
+        self.assertIsNone(result_cache.get(1, 'h', 'table_1_h', RUN_TIME))
+
+    def test_unknown_run_time_keeps_entry(self):
+        result_cache.put(1, 'h', 'table_1_h', RUN_TIME, frame())
+        self.assertIsNone(result_cache.get(1, 'h', 'table_1_h', None))
+        self.assertIsNotNone(
+            result_cache.get(1, 'h', 'table_1_h', RUN_TIME))
+
+    def test_object_columns_sized(self):
+        numbers = pd.DataFrame({'a': range(100)})
+        strings = pd.DataFrame({'a': ['x' * 1000] * 100})
+        self.assertGreater(result_cache.data_size(strings),
+                           result_cache.data_size(numbers) + 100 * 1000)
+
+    def test_invalidate_table(self):
+        result_cache.put(1, 'h', 'table_1_h', RUN_TIME, frame())
+        result_cache.invalidate_table('table_1_h')
+        self.assertIsNone(result_cache.get(1, 'h', 'table_1_h', RUN_TIME))
+        self.assertEqual(result_cache._total_bytes, 0)
+
+    def test_least_recently_used_evicted(self):
+        size = result_cache.data_size(frame(200))
+        result_cache.get_budget.return_value = size * 2
+        result_cache.put(1, 'h', 'table_1', RUN_TIME, frame(200))
+        result_cache.put(2, 'h', 'table_2', RUN_TIME, frame(200))
+        result_cache.get(1, 'h', 'table_1', RUN_TIME)
+        result_cache.put(3, 'h', 'table_3', RUN_TIME, frame(200))
+        self.assertIsNotNone(result_cache.get(1, 'h', 'table_1', RUN_TIME))
+        self.assertIsNone(result_cache.get(2, 'h', 'table_2', RUN_TIME))
+        self.assertIsNotNone(result_cache.get(3, 'h', 'table_3', RUN_TIME))
+        self.assertEqual(result_cache._total_bytes, size * 2)
+
+    def test_too_large(self):
+        result_cache.get_budget.return_value = 0
+        self.assertFalse(
+            result_cache.put(1, 'h', 'table_1_h', RUN_TIME, frame()))
+        self.assertIsNone(result_cache.get(1, 'h', 'table_1_h', RUN_TIME))
@@ -0,0 +1,156 @@
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from taggit.models import TaggedItem
+
+import threading
+import time
+
+import models
+import definition_cache
+
+# Process wide memo of who may run which saved query, keyed on
+# (user id, query id) holding (allowed, groups granting access, time), and
+# of each user's group names.  Signals in models drop entries when
+# memberships or tags change, the TTL bounds changes made by other processes
+_decisions = {}
+_groups = {}
+_lock = threading.Lock()
+# Bumped by every invalidation so a lookup racing one is not kept
+_generation = [0]
+
+
+def get_ttl():
+    """
+    Returns the seconds a decision is used for, 0 disables the cache
+    """
+    return getattr(settings, 'ACL_CACHE_TTL', 300)
+
+
+def resolve(user_groups, db_tags, query_tags):
+    """
+    Returns (allowed, groups granting access)
+    Access needs a group named after a tag of the query or its database,
+    queries on untagged databases are open to everyone
+    """
+    union_set = db_tags | query_tags
+    if len(union_set & user_groups) > 0:
+        return (True, union_set)
+    return (len(db_tags) == 0, union_set)
+
+
+def user_groups(user):
+    """
+    Returns the set of the user's group names
+    """
+    ttl = get_ttl()
+    with _lock:
+        entry = _groups.get(user.id)
+        generation = _generation[0]
+    if entry is not None and time.time() - entry[1] < ttl:
+        return entry[0]
+    groups = set(user.groups.values_list('name', flat=True))
+    _store(_groups, user.id, (groups, time.time()), generation, ttl)
+    return groups
+
+
+def query_allowed(user, query_id):
+    """
+    Returns (allowed, groups granting access) of a saved query for an
+    active user who is not a superuser
+    """
+    key = (user.id, int(query_id))
+    ttl = get_ttl()
+    with _lock:
+        entry = _decisions.get(key)
+        generation = _generation[0]
+    if entry is not None and time.time() - entry[2] < ttl:
+        return entry[:2]
+    definition = definition_cache.get(query_id)
+    decision = resolve(
+        user_groups(user), definition.db_tags, definition.query_tags)
+    _store(_decisions, key, decision + (time.time(),), generation, ttl)
+    return decision
+
+
+def allowed_query_ids(user, query_ids):
+    """
+    Returns the set of query ids the user may run, for listing pages
+    Queries not already decided are resolved together, with one lookup
+    for their databases and one per kind of tag
+    """
+    query_ids = set(int(i) for i in query_ids)
+    if not user.is_active:
+        return set()
+    if user.is_superuser:
+        return query_ids
+    ttl = get_ttl()
+    now = time.time()
+    allowed = set()
+    missing = []
+    with _lock:
+        generation = _generation[0]
+        for query_id in query_ids:
+            entry = _decisions.get((user.id, query_id))
+            if entry is None or now - entry[2] >= ttl:
+                missing.append(query_id)
+            elif entry[0]:
+                allowed.add(query_id)
+    if not missing:
+        return allowed
+    db_ids = dict(models.Query.objects.filter(
+        id__in=missing).values_list('id', 'db_id'))
+    query_tags = tag_names(models.Query, db_ids.keys())
+    db_tags = tag_names(models.Db, set(db_ids.values()))
+    groups = user_groups(user)
+    for query_id, db_id in db_ids.items():
+        decision = resolve(groups, db_tags.get(db_id, set()),
+                           query_tags.get(query_id, set()))
+        _store(_decisions, (user.id, query_id), decision + (now,),
+               generation, ttl)
+        if decision[0]:
+            allowed.add(query_id)
+    return allowed
+
+
+def tag_names(model, object_ids):
+    """
+    Returns dict of object id to the set of its tag names
+    """
+    tags = {}
+    if not object_ids:
+        return tags
+    for object_id, name in TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(model),
+            object_id__in=object_ids).values_list('object_id', 'tag__name'):
+        tags.setdefault(object_id, set()).add(name)
+    return tags
+
+
+def _store(entries, key, value, generation, ttl):
+    if ttl <= 0:
+        return
+    with _lock:
+        if generation == _generation[0]:
+            entries[key] = value
+
+
+def invalidate_user(user_id):
+    """
+    Drops a user's groups and decisions
+    """
+    with _lock:
+        _generation[0] += 1
+        _groups.pop(user_id, None)
+        for key in _decisions.keys():
+            if key[0] == user_id:
+                del _decisions[key]
+
+
+def clear():
+    """
+    Drops everything, for changes that can reach many users or queries
+    """
+    with _lock:
+        _generation[0] += 1
+        _groups.clear()
+        _decisions.clear()
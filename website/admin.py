@@ -59,6 +59,15 @@ class DashboardAdmin(admin.ModelAdmin):
     list_display = ('id', 'title', 'owner', 'modified_time')
 
 
+class QueryJobAdmin(admin.ModelAdmin):
+    model = QueryJob
+    list_display = (
+        'id', 'query', 'user', 'state', 'progress', 'submit_time',
+        'execution_time')
+    list_filter = ('state',)
+
+
 admin.site.register(Query, QueryAdmin)
 admin.site.register(Db, DbAdmin)
 admin.site.register(Dashboard, DashboardAdmin)
+admin.site.register(QueryJob, QueryJobAdmin)
@@ -0,0 +1,155 @@
+import datetime
+import math
+import os
+import tempfile
+import uuid
+
+import query
+
+# Column types for each query.column_dtype by SQLAlchemy dialect
+COLUMN_DDL = {
+    'mysql': {
+        'boolean': 'BOOLEAN', 'integer': 'BIGINT', 'float': 'DOUBLE',
+        'datetime': 'DATETIME', 'date': 'DATE', 'timedelta': 'TEXT',
+        'string': 'LONGTEXT'},
+    'postgresql': {
+        'boolean': 'BOOLEAN', 'integer': 'BIGINT',
+        'float': 'DOUBLE PRECISION', 'datetime': 'TIMESTAMP',
+        'date': 'DATE', 'timedelta': 'TEXT', 'string': 'TEXT'},
+}
+NULL = '\\N'
+
+
+def supported(engine):
+    """
+    returns True if the engine's database can bulk load
+    """
+    return engine.dialect.name in COLUMN_DDL
+
+
+def quote_name(name, dialect):
+    """
+    Quotes a table or column name
+    """
+    name = unicode(name)
+    if dialect == 'mysql':
+        return u'`%s`' % name.replace(u'`', u'``')
+    return u'"%s"' % name.replace(u'"', u'""')
+
+
+def create_table_sql(table_name, data, dialect):
+    """
+    returns a CREATE TABLE statement with a column for each DataFrame
+    column, typed from its dtype
+    """
+    columns = [
+        u'%s %s' % (quote_name(column, dialect),
+                    COLUMN_DDL[dialect][query.column_dtype(data.iloc[:, i])])
+        for i, column in enumerate(data.columns)]
+    return u'CREATE TABLE %s (%s)' % (
+        quote_name(table_name, dialect), u', '.join(columns))
+
+
+def format_value(value):
+    """
+    Formats a value as a tab separated field understood by both
+    LOAD DATA and COPY, with \\N for null
+    """
+    if value is None:
+        return NULL
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            return NULL
+        return repr(value)
+    if isinstance(value, (int, long)):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(' ')
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    elif not isinstance(value, str):
+        value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace(
+        '\n', '\\n').replace('\r', '\\r')
+
+
+def write_tsv(data, f):
+    """
+    Writes the DataFrame's rows to a file as tab separated text
+    """
+    columns = [
+        [format_value(v) for v in query.column_to_list(data.iloc[:, i])]
+        for i in range(len(data.columns))]
+    for row in zip(*columns):
+        f.write('\t'.join(row))
+        f.write('\n')
+
+
+def swap_sql(table_name, tmp_name, dialect):
+    """
+    returns the statements replacing table_name with tmp_name
+    MySQL renames both tables in one statement, Postgres relies on the
+    statements sharing a transaction
+    """
+    table = quote_name(table_name, dialect)
+    tmp = quote_name(tmp_name, dialect)
+    if dialect == 'mysql':
+        old = quote_name('old_%s' % tmp_name[len('tmp_'):], dialect)
+        return [
+            # RENAME TABLE needs an existing table to move out of the way
+            u'CREATE TABLE IF NOT EXISTS %s LIKE %s' % (table, tmp),
+            u'RENAME TABLE %s TO %s, %s TO %s' % (table, old, tmp, table),
+            u'DROP TABLE %s' % old]
+    return [
+        u'DROP TABLE IF EXISTS %s' % table,
+        u'ALTER TABLE %s RENAME TO %s' % (tmp, table)]
+
+
+def save(engine, table_name, data):
+    """
+    Replaces a table with the contents of a DataFrame using
+    LOAD DATA LOCAL INFILE on MySQL or COPY on Postgres
+    Rows are loaded into a new table which is swapped in afterwards, so
+    readers never see the table missing or half loaded
+    """
+    dialect = engine.dialect.name
+    tmp_name = 'tmp_%s' % uuid.uuid4().hex
+    f = tempfile.NamedTemporaryFile(
+        prefix='sqlviz_%s_' % table_name, suffix='.tsv', delete=False)
+    try:
+        with f:
+            write_tsv(data, f)
+        dbapi_connection = engine.raw_connection()
+        try:
+            cursor = dbapi_connection.cursor()
+            try:
+                cursor.execute(create_table_sql(tmp_name, data, dialect))
+                if dialect == 'mysql':
+                    cursor.execute(
+                        u"LOAD DATA LOCAL INFILE %%s INTO TABLE %s "
+                        u"CHARACTER SET utf8" % quote_name(tmp_name, dialect),
+                        (f.name,))
+                else:
+                    with open(f.name) as tsv:
+                        cursor.copy_expert(u'COPY %s FROM STDIN' % quote_name(
+                            tmp_name, dialect), tsv)
+                for sql in swap_sql(table_name, tmp_name, dialect):
+                    cursor.execute(sql)
+                dbapi_connection.commit()
+            except Exception:
+                # MySQL commits DDL straight away so the new table may exist
+                dbapi_connection.rollback()
+                cursor.execute(u'DROP TABLE IF EXISTS %s' % quote_name(
+                    tmp_name, dialect))
+                dbapi_connection.commit()
+                raise
+            finally:
+                cursor.close()
+        finally:
+            dbapi_connection.close()
+    finally:
+        os.remove(f.name)
@@ -0,0 +1,176 @@
+from django.conf import settings
+
+import cPickle
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import uuid
+
+import bulk_load
+import get_db_engine
+
+
+class MySQLCacheBackend:
+    """
+    Stores cached results as tables in the write_to database
+    Precedent results must use this backend so queries can join on them
+    """
+    name = 'mysql'
+
+    def save(self, table_name, data, batch_size=1000):
+        engine = get_db_engine.get_db_engine()
+        # TODO put in limits for data size (cols x rows to insert data)
+        if getattr(settings, 'CACHE_BULK_LOAD', True) and \
+                bulk_load.supported(engine):
+            try:
+                bulk_load.save(engine, table_name, data)
+                return
+            except Exception, e:
+                # e.g. local_infile is off, the default from MySQL 8
+                logging.warning(
+                    'Bulk load of %s failed, inserting instead: %s' % (
+                        table_name, e))
+        data.to_sql(table_name, con=engine, if_exists='replace',
+                    index=False, chunksize=batch_size)
+
+    def load(self, table_name):
+        engine = get_db_engine.get_db_engine()
+        data = pd.read_sql_table(table_name, con=engine, coerce_float=True)
+        return data.convert_objects(convert_numeric=True)
+
+    def size(self, table_name):
+        """
+        Returns the bytes the table takes in the database, None if the
+        database does not say
+        """
+        engine = get_db_engine.get_db_engine()
+        if engine.dialect.name == 'mysql':
+            sql = """select data_length + index_length
+                from information_schema.tables
+                where table_schema = database() and table_name = %s"""
+        elif engine.dialect.name == 'postgresql':
+            sql = """select pg_total_relation_size(
+                quote_ident(%s)::regclass)"""
+        else:
+            return None
+        row = engine.execute(sql, (table_name,)).first()
+        if row is None or row[0] is None:
+            return None
+        return int(row[0])
+
+    def drop(self, table_name):
+        self.drop_many([table_name])
+
+    def drop_many(self, table_names, batch_size=None):
+        """
+        Drops tables over one connection, batch_size tables per statement
+        """
+        if batch_size is None:
+            batch_size = getattr(settings, 'CACHE_EVICTION_BATCH', 500)
+        engine = get_db_engine.get_db_engine()
+        c = engine.connect()
+        try:
+            for i in range(0, len(table_names), batch_size):
+                c.execute("""drop table if exists %s""" % (
+                    ', '.join(table_names[i:i + batch_size])))
+        finally:
+            c.close()
+
+
+class FileCacheBackend:
+    """
+    Stores cached results as a directory of column files under
+    settings.CACHE_DIR
+    Numeric and datetime columns are saved as .npy files and read back
+    memory mapped, other columns are pickled
+    """
+    name = 'file'
+
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = getattr(settings, 'CACHE_DIR',
+                                os.path.join(settings.BASE_DIR, 'cache'))
+        self.cache_dir = cache_dir
+
+    def path(self, table_name):
+        return os.path.join(self.cache_dir, table_name)
+
+    def save(self, table_name, data):
+        # Write next to the old result and swap it in so readers never see
+        # a half written directory
+        tmp_path = self.path('%s.%s.tmp' % (table_name, uuid.uuid4().hex))
+        os.makedirs(tmp_path)
+        columns = []
+        for i, column in enumerate(data.columns):
+            values = data.iloc[:, i].values
+            if values.dtype.kind in 'biufcmM':
+                file_name = '%s.npy' % i
+                np.save(os.path.join(tmp_path, file_name), values)
+            else:
+                file_name = '%s.pkl' % i
+                with open(os.path.join(tmp_path, file_name), 'wb') as f:
+                    cPickle.dump(values, f, cPickle.HIGHEST_PROTOCOL)
+            columns.append({'name': column, 'file': file_name})
+        with open(os.path.join(tmp_path, 'columns.json'), 'w') as f:
+            json.dump(columns, f)
+        old_path = None
+        if os.path.exists(self.path(table_name)):
+            old_path = self.path(
+                '%s.%s.old' % (table_name, uuid.uuid4().hex))
+            os.rename(self.path(table_name), old_path)
+        os.rename(tmp_path, self.path(table_name))
+        if old_path is not None:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+    def load(self, table_name):
+        path = self.path(table_name)
+        with open(os.path.join(path, 'columns.json')) as f:
+            columns = json.load(f)
+        data = {}
+        for i, column in enumerate(columns):
+            file_path = os.path.join(path, column['file'])
+            if file_path.endswith('.npy'):
+                data[i] = np.load(file_path, mmap_mode='r')
+            else:
+                with open(file_path, 'rb') as f:
+                    data[i] = cPickle.load(f)
+        # Keyed on position as column names need not be unique
+        data = pd.DataFrame(data, columns=range(len(columns)))
+        data.columns = [c['name'] for c in columns]
+        return data
+
+    def size(self, table_name):
+        """
+        Returns the bytes the result's files take on disk
+        """
+        path = self.path(table_name)
+        return sum(os.path.getsize(os.path.join(path, file_name))
+                   for file_name in os.listdir(path))
+
+    def drop(self, table_name):
+        shutil.rmtree(self.path(table_name))
+
+    def drop_many(self, table_names, batch_size=None):
+        for table_name in table_names:
+            shutil.rmtree(self.path(table_name), ignore_errors=True)
+
+
+BACKENDS = {
+    MySQLCacheBackend.name: MySQLCacheBackend,
+    FileCacheBackend.name: FileCacheBackend,
+}
+
+
+def get_cache_backend(name=None):
+    """
+    Returns the storage backend for cached results by name
+    defaults to settings.CACHE_BACKEND
+    """
+    if name is None:
+        name = getattr(settings, 'CACHE_BACKEND', 'mysql')
+    if name not in BACKENDS:
+        raise ValueError('Unknown cache backend %s' % name)
+    return BACKENDS[name]()
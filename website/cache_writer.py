@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.db import connection
+
+import Queue
+import copy
+import logging
+import threading
+import traceback
+
+# Bounded queues feeding the background cache writer threads
+# A table name always maps to the same writer so writes never overlap
+_queues = []
+_queues_lock = threading.Lock()
+
+
+def get_queues():
+    """
+    Returns the writer queues, starting the writer threads on first use
+    """
+    with _queues_lock:
+        if not _queues:
+            for i in range(getattr(settings, 'CACHE_WRITERS', 2)):
+                queue = Queue.Queue(
+                    getattr(settings, 'CACHE_WRITE_QUEUE_SIZE', 16))
+                thread = threading.Thread(
+                    target=writer, args=(queue,),
+                    name='sqlviz-cache-writer-%s' % i)
+                thread.daemon = True
+                thread.start()
+                _queues.append(queue)
+        return _queues
+
+
+def submit(run_query, table_name, cache_lock=None):
+    """
+    Queues a RunQuery's data to be saved to the cache in the background
+    The writer releases cache_lock once the cache is saved
+    returns False when the queue is full and the caller must save itself
+    """
+    if getattr(settings, 'CACHE_WRITE_QUEUE_SIZE', 16) <= 0:
+        return False
+    queues = get_queues()
+    queue = queues[hash(table_name) % len(queues)]
+    try:
+        # Copy so later manipulations of the query's data are not saved
+        queue.put_nowait((copy.copy(run_query), table_name, cache_lock))
+    except Queue.Full:
+        logging.warning('Cache write queue full, saving %s now' % table_name)
+        return False
+    return True
+
+
+def writer(queue):
+    """
+    Writer thread, saves queued results one at a time
+    """
+    while True:
+        run_query, table_name, cache_lock = queue.get()
+        try:
+            write(run_query, table_name, cache_lock)
+        finally:
+            queue.task_done()
+
+
+def write(run_query, table_name, cache_lock=None):
+    """
+    Saves a result to the cache and releases its lock
+    """
+    try:
+        run_query.save_to_mysql(table_name)
+    except Exception:
+        logging.error(traceback.format_exc())
+    finally:
+        if cache_lock is not None:
+            cache_lock.release()
+        connection.close()
+
+
+def flush():
+    """
+    Waits for every queued write to finish
+    """
+    for queue in list(_queues):
+        queue.join()
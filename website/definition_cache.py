@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.http import Http404
+
+import threading
+import time
+
+import models
+
+# Process wide cache of what running a saved query needs to know about it,
+# keyed on query id.  Signals in models drop entries when the rows change,
+# the TTL bounds how long changes made by other processes go unseen
+_entries = {}
+_entries_lock = threading.Lock()
+# Bumped by every invalidation so a load racing one is not kept
+_generation = [0]
+
+
+class QueryDefinition:
+    """
+    A Query row with its database, defaults, direct precedents and tags
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.db = query.db
+        self.defaults = list(
+            models.QueryDefault.objects.filter(query_id=query.id))
+        self.precedent_ids = list(
+            models.QueryPrecedent.objects.filter(
+                final_query_id=query.id
+            ).values_list('preceding_query_id', flat=True))
+        self.query_tags = set([str(i) for i in query.tags.all()])
+        self.db_tags = set([str(i) for i in self.db.tags.all()])
+        self.load_time = time.time()
+
+
+def get_ttl():
+    """
+    Returns the seconds a definition is used for, 0 disables the cache
+    """
+    return getattr(settings, 'QUERY_DEFINITION_TTL', 300)
+
+
+def get(query_id):
+    """
+    Returns the QueryDefinition of a query
+    raises Http404 if the query does not exist
+    """
+    query_id = int(query_id)
+    ttl = get_ttl()
+    with _entries_lock:
+        definition = _entries.get(query_id)
+        generation = _generation[0]
+    if definition is not None and time.time() - definition.load_time < ttl:
+        return definition
+    query = models.Query.objects.select_related('db').filter(
+        id=query_id).first()
+    if query is None:
+        raise Http404('No Query matches the given query.')
+    definition = QueryDefinition(query)
+    if ttl > 0:
+        with _entries_lock:
+            if generation == _generation[0]:
+                _entries[query_id] = definition
+    return definition
+
+
+def invalidate(query_id):
+    """
+    Drops the definition of a query
+    """
+    with _entries_lock:
+        _generation[0] += 1
+        _entries.pop(int(query_id), None)
+
+
+def clear():
+    """
+    Drops every definition, for changes that can reach many queries
+    """
+    with _entries_lock:
+        _generation[0] += 1
+        _entries.clear()
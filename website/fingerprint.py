@@ -0,0 +1,144 @@
+import hashlib
+import re
+
+# Words compared without case, everything else is kept as written since
+# identifiers can be case sensitive
+KEYWORDS = set("""
+    ALL AND ANY AS ASC BETWEEN BY CASE CAST CROSS DESC DISTINCT ELSE END
+    EXISTS FALSE FOR FROM FULL GROUP HAVING IF ILIKE IN INNER INTERVAL IS
+    JOIN LEFT LIKE LIMIT NATURAL NOT NULL OFFSET ON OR ORDER OUTER OVER
+    PARTITION REGEXP RIGHT ROLLUP SELECT THEN TRUE UNION USING WHEN WHERE
+    WITH XOR DAY HOUR MINUTE MONTH SECOND WEEK YEAR
+    ABS AVG COALESCE CONCAT COUNT DATE DATEDIFF DATE_ADD DATE_FORMAT
+    DATE_SUB DATE_TRUNC EXTRACT FLOOR CEIL GREATEST IFNULL LEAST LENGTH
+    LOWER MAX MIN NOW NULLIF ROUND STR_TO_DATE SUBSTRING SUM TRIM UPPER
+""".split())
+
+TOKENS = r"""
+    (?P<comment>%(line_comment)s|/\*(?![!+]).*?\*/)
+  | (?P<literal>%(strings)s)
+  | (?P<space>\s+)
+  | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<other>/\*.*?\*/|<=|>=|<>|!=|\|\||::|:=|.)
+"""
+TOKEN_PATTERNS = {
+    # MySQL strings use backslash escapes, # starts a comment and so does
+    # -- but only when followed by whitespace or a control character
+    'MySQL': re.compile(TOKENS % {
+        'line_comment': r'--(?:[\s\x00-\x1f]|$)[^\n]*|\#[^\n]*',
+        'strings': r"""'(?:[^'\\]|\\.|'')*'"""
+                   r"""|"(?:[^"\\]|\\.|"")*"|`(?:[^`]|``)*`"""
+    }, re.S | re.X),
+    # Postgres also has E'' strings with backslash escapes and dollar
+    # quoted strings, whose tag can not start with a digit unlike $1
+    'Postgres': re.compile(TOKENS % {
+        'line_comment': r'--[^\n]*',
+        'strings': r"""[eE]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'"""
+                   r"""|"(?:[^"]|"")*\""""
+                   r"""|\$(?P<tag>[A-Za-z_][A-Za-z0-9_]*|)\$.*?\$(?P=tag)\$"""
+    }, re.S | re.X),
+}
+
+
+def spans(sql, db_type='MySQL'):
+    """
+    Yields (kind, start, end) for every token of the SQL, comments and
+    whitespace included
+    """
+    pattern = TOKEN_PATTERNS.get(db_type, TOKEN_PATTERNS['MySQL'])
+    for match in pattern.finditer(sql):
+        yield (match.lastgroup, match.start(), match.end())
+
+
+def select_list(sql, sql_spans):
+    """
+    Returns (start, end) of the outermost select list without the comments
+    and whitespace around it, None if the SQL has no select
+    The first select at the top level wins, as in WITH ... SELECT
+    """
+    depth = 0
+    found = None
+    for i, (kind, start, end) in enumerate(sql_spans):
+        token = sql[start:end]
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif kind == 'word' and token.upper() == 'SELECT':
+            if depth == 0:
+                found = i
+                break
+            elif found is None:
+                found = i
+    if found is None:
+        return None
+    # Runs to the FROM, INTO or UNION of this select, the parenthesis
+    # closing it or the end of the statement
+    depth = 0
+    items = []
+    for kind, start, end in sql_spans[found + 1:]:
+        token = sql[start:end]
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+            if depth < 0:
+                break
+        elif depth == 0 and (token == ';' or kind == 'word' and
+                             token.upper() in ('FROM', 'INTO', 'UNION')):
+            break
+        items.append((kind, start, end))
+    while items and items[0][0] in ('comment', 'space'):
+        items.pop(0)
+    while items and items[-1][0] in ('comment', 'space'):
+        items.pop()
+    if not items:
+        return None
+    return (items[0][1], items[-1][2])
+
+
+def tokens(sql, db_type='MySQL'):
+    """
+    Splits SQL into tokens, dropping comments and whitespace
+    Keywords are lower cased, literals and identifiers are kept as is
+    On MySQL the outermost select list is kept as written in one token,
+    since unaliased columns are labelled with their text
+    """
+    sql_spans = list(spans(sql, db_type))
+    columns = None
+    if db_type != 'Postgres':
+        columns = select_list(sql, sql_spans)
+    for kind, start, end in sql_spans:
+        if columns is not None and columns[0] <= start < columns[1]:
+            if start == columns[0]:
+                yield sql[columns[0]:columns[1]]
+            continue
+        token = sql[start:end]
+        if kind in ('comment', 'space'):
+            continue
+        if kind == 'word' and token.upper() in KEYWORDS:
+            token = token.lower()
+        yield token
+
+
+def normalize(sql, db_type='MySQL'):
+    """
+    Returns the SQL with whitespace, comments and keyword case normalized
+    outside the MySQL select list and any trailing semicolons removed
+    """
+    sql_tokens = list(tokens(sql, db_type))
+    while sql_tokens and sql_tokens[-1] == ';':
+        sql_tokens.pop()
+    return ' '.join(sql_tokens)
+
+
+def fingerprint(sql, db_type='MySQL'):
+    """
+    Returns a hash of the normalized SQL, equal for queries that only
+    differ in formatting that does not change the result
+    """
+    normalized = normalize(sql, db_type)
+    if isinstance(normalized, unicode):
+        normalized = normalized.encode('utf-8')
+    return hashlib.md5(normalized).hexdigest()
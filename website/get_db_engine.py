@@ -1,11 +1,46 @@
 import sqlviz.settings as settings
 import sqlalchemy
+import threading
+from sqlalchemy import event, exc
 from urllib import quote_plus as urlquote
 
+# Process wide registry of pooled engines for the source databases
+# keyed on Db id, holding (modified_time, engine)
+_source_engines = {}
+_source_engines_lock = threading.Lock()
+# Engines for settings.CUSTOM_DATABASES keyed on name
+_custom_engines = {}
+# Semaphores bounding concurrent batch queries per source Db id
+_db_semaphores = {}
+
 
 def get_db_engine(db_name='write_to'):
     """
     Emits a SQL alchemy engine from the settings file
+    The engine and its connection pool are shared by the whole process
+    """
+    with _source_engines_lock:
+        if db_name not in _custom_engines:
+            _custom_engines[db_name] = create_custom_engine(db_name)
+        return _custom_engines[db_name]
+
+
+def get_lock_engine(db_name='write_to'):
+    """
+    Emits the engine advisory locks are taken on, with a pool of its own
+    as a lock holds its connection until the locked result is saved
+    """
+    with _source_engines_lock:
+        key = (db_name, 'locks')
+        if key not in _custom_engines:
+            _custom_engines[key] = create_custom_engine(
+                db_name, getattr(settings, 'LOCK_POOL', {}))
+        return _custom_engines[key]
+
+
+def create_custom_engine(db_name, pool_settings=None):
+    """
+    Builds a new engine for a database in settings.CUSTOM_DATABASES
     """
     db = settings.CUSTOM_DATABASES[db_name]
     engine_string = '%s://%s:%s@%s:%s/%s' % (
@@ -15,4 +50,98 @@ def get_db_engine(db_name='write_to'):
         db['HOST'],
         db['PORT'],
         db['NAME'])
-    return sqlalchemy.create_engine(engine_string,)
+    connect_args = {}
+    if engine_string.startswith('mysql'):
+        # Cache tables are bulk loaded with LOAD DATA LOCAL INFILE
+        connect_args['local_infile'] = 1
+    return create_pooled_engine(engine_string, connect_args, pool_settings)
+
+
+def get_source_engine(db):
+    """
+    Returns a pooled SQL alchemy engine for a website.models.Db row
+    Engines are reused until a newer version of the Db row is seen
+    """
+    with _source_engines_lock:
+        cached = _source_engines.get(db.id)
+        # Cached definitions can hand out an older copy of the row after
+        # a newer one, which must not bring back the old engine
+        if cached is not None and not db.modified_time > cached[0]:
+            return cached[1]
+        if cached is not None:
+            cached[1].dispose()
+        engine = create_source_engine(db)
+        _source_engines[db.id] = (db.modified_time, engine)
+        return engine
+
+
+def create_source_engine(db):
+    """
+    Builds a new pooled engine for a Db row
+    """
+    engine_string = '%s://%s:%s@%s:%s/%s' % (
+        db.type.lower(),
+        db.username,
+        urlquote(db.password_encrypted),
+        db.host,
+        db.port,
+        db.db
+    )
+    return create_pooled_engine(engine_string)
+
+
+def create_pooled_engine(engine_string, connect_args=None,
+                         pool_settings=None):
+    """
+    Creates an engine with the pool options in pool_settings,
+    settings.DB_POOL by default
+    """
+    if pool_settings is None:
+        pool_settings = getattr(settings, 'DB_POOL', {})
+    engine = sqlalchemy.create_engine(
+        engine_string,
+        connect_args=connect_args or {},
+        pool_size=pool_settings.get('POOL_SIZE', 5),
+        max_overflow=pool_settings.get('MAX_OVERFLOW', 10),
+        pool_timeout=pool_settings.get('POOL_TIMEOUT', 30),
+        pool_recycle=pool_settings.get('POOL_RECYCLE', 3600),
+    )
+    if pool_settings.get('PRE_PING', True):
+        event.listen(engine.pool, 'checkout', ping_connection)
+    return engine
+
+
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """
+    Checks a pooled connection is alive before handing it out
+    Stale connections are discarded and the pool reconnects
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("SELECT 1")
+    except Exception:
+        raise exc.DisconnectionError()
+    finally:
+        cursor.close()
+
+
+def dispose_source_engine(db_id):
+    """
+    Drops the pooled engine for a Db so the next query reconnects
+    """
+    with _source_engines_lock:
+        cached = _source_engines.pop(db_id, None)
+    if cached is not None:
+        cached[1].dispose()
+
+
+def get_db_semaphore(db_id):
+    """
+    Returns the process wide semaphore limiting concurrent batch queries
+    against one source database
+    """
+    with _source_engines_lock:
+        if db_id not in _db_semaphores:
+            _db_semaphores[db_id] = threading.BoundedSemaphore(
+                getattr(settings, 'BATCH_DB_CONCURRENCY', 4))
+        return _db_semaphores[db_id]
@@ -0,0 +1,156 @@
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from multiprocessing.pool import ThreadPool
+
+import json
+import logging
+import threading
+import time
+import traceback
+
+import models
+import query
+
+# Worker pool shared by all asynchronous query jobs in this process
+_job_pool = None
+_job_pool_lock = threading.Lock()
+# (query_id, query_hash) of stale caches being refreshed in this process
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def get_job_pool():
+    """
+    Returns the process wide worker pool, created on first use
+    """
+    global _job_pool
+    with _job_pool_lock:
+        if _job_pool is None:
+            _job_pool = ThreadPool(getattr(settings, 'QUERY_JOB_WORKERS', 4))
+        return _job_pool
+
+
+def submit_job(query_id, user, parameters):
+    """
+    Records a QueryJob and queues it on the worker pool
+    returns the QueryJob
+    """
+    job = models.QueryJob.objects.create(
+        query_id=query_id,
+        user=user,
+        parameters=json.dumps(parameters))
+    get_job_pool().apply_async(run_job, (job.id,))
+    return job
+
+
+def run_job(job_id):
+    """
+    Runs the query of a QueryJob, leaving the result in the query cache
+    """
+    try:
+        job = models.QueryJob.objects.get(id=job_id)
+        start_time = time.time()
+        job.state = 'running'
+        job.start_time = timezone.now()
+        job.progress = 0.1
+        job.save()
+        try:
+            # Always cache, the result is fetched from the cache later
+            lq = query.LoadQuery(
+                query_id=job.query_id,
+                user=job.user,
+                parameters=json.loads(job.parameters),
+                cacheable=True)
+            q = lq.prepare_query()
+            q.run_query(write_behind=False)
+            table_name = q.check_cache()
+            if not table_name:
+                raise Exception("Query result was not cached")
+            job.table_name = table_name
+            job.cached = q.get_cache_status()
+            job.state = 'done'
+        except Exception, e:
+            logging.warning(traceback.format_exc())
+            job.error = str(e)
+            job.state = 'failed'
+        job.progress = 1.0
+        job.end_time = timezone.now()
+        job.execution_time = time.time() - start_time
+        job.save()
+    finally:
+        connection.close()
+
+
+def refresh_cache(q):
+    """
+    Re-runs a query in the background to replace its stale cache entry
+    Only one refresh of a query and hash is queued per process
+    returns True if a refresh was queued
+    """
+    key = (q.query_id, q.query_hash)
+    with _refreshing_lock:
+        if key in _refreshing:
+            return False
+        _refreshing.add(key)
+    get_job_pool().apply_async(
+        run_refresh, (key, q.query_id, q.user, dict(q.parameters or {})))
+    return True
+
+
+def run_refresh(key, query_id, user, parameters):
+    """
+    Runs a query skipping the cache so the cache is rewritten
+    """
+    try:
+        lq = query.LoadQuery(
+            query_id=query_id,
+            user=user,
+            parameters=parameters,
+            cacheable=True,
+            force_refresh=True)
+        q = lq.prepare_query()
+        q.run_query(write_behind=False, record_view=False)
+    except Exception:
+        logging.warning(traceback.format_exc())
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+        connection.close()
+
+
+def job_status(job):
+    """
+    Returns the poll API response for a QueryJob as a dict
+    """
+    return {
+        "job_id": job.id,
+        "query_id": job.query_id,
+        "state": job.state,
+        "progress": job.progress,
+        "time_elapsed": round(job.execution_time, 2),
+        "cached": job.cached,
+        "error": job.state == 'failed',
+        "data": job.error}
+
+
+def job_result(job, output_format='array'):
+    """
+    Loads a finished QueryJob's result from the cache and manipulates it
+    returns the ManipulateData object
+    """
+    if job.state != 'done':
+        raise Exception("Job %s is %s" % (job.id, job.state))
+    lq = query.LoadQuery(
+        query_id=job.query_id,
+        user=job.user,
+        parameters=json.loads(job.parameters),
+        cacheable=True)
+    q = lq.prepare_query()
+    q.prepare_safety()
+    q.check_permission()
+    q.retrieve_cache(job.table_name)
+    q.slice_data()
+    q.cached = True
+    q.run_manipulations(output_format)
+    return q
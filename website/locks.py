@@ -0,0 +1,88 @@
+from django.conf import settings
+from sqlalchemy import text
+
+import logging
+import time
+
+import get_db_engine
+
+
+class AdvisoryLock:
+    """
+    Named lock held in the write_to database, so it is shared by every
+    process writing to the same scratch database
+    The lock belongs to the connection that took it and is released when
+    that connection is released, a lock that can not get a connection is
+    not taken
+    """
+
+    def __init__(self, name, timeout=None):
+        self.name = name
+        if timeout is None:
+            timeout = getattr(settings, 'CACHE_LOCK_TIMEOUT', 60)
+        self.timeout = timeout
+        self.connection = None
+        self.acquired = False
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def acquire(self):
+        """
+        Waits up to timeout seconds for the lock
+        returns True if the lock was taken
+        """
+        try:
+            self.connection = get_db_engine.get_lock_engine().connect()
+            dialect = self.connection.dialect.name
+            if dialect == 'mysql':
+                self.acquired = self.connection.execute(
+                    text("SELECT GET_LOCK(:name, :timeout)"),
+                    name=self.name, timeout=self.timeout).scalar() == 1
+            elif dialect == 'postgresql':
+                self.acquired = self.acquire_postgres()
+            else:
+                logging.warning('No advisory locks for %s' % dialect)
+        except Exception, e:
+            logging.error('Could not take lock %s -- %s' % (self.name, e))
+        if not self.acquired and self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        return self.acquired
+
+    def acquire_postgres(self):
+        """
+        Postgres advisory locks can not time out so poll for the lock
+        """
+        give_up_time = time.time() + self.timeout
+        while True:
+            if self.connection.execute(
+                    text("SELECT pg_try_advisory_lock(hashtext(:name))"),
+                    name=self.name).scalar():
+                return True
+            if time.time() > give_up_time:
+                return False
+            time.sleep(0.1)
+
+    def release(self):
+        """
+        Releases the lock if it is held
+        """
+        if not self.acquired:
+            return
+        try:
+            if self.connection.dialect.name == 'mysql':
+                self.connection.execute(
+                    text("SELECT RELEASE_LOCK(:name)"), name=self.name)
+            else:
+                self.connection.execute(
+                    text("SELECT pg_advisory_unlock(hashtext(:name))"),
+                    name=self.name)
+        finally:
+            self.acquired = False
+            self.connection.close()
+            self.connection = None
@@ -1,5 +1,20 @@
+from collections import OrderedDict
 from datetime import date, timedelta
+import bisect
 import re
+import threading
+
+import fingerprint
+
+# Compiled templates kept by get_template
+TEMPLATE_CACHE_SIZE = 512
+_templates = OrderedDict()
+_templates_lock = threading.Lock()
+# Quotes around a placeholder that make it a whole string literal, by type
+STRING_QUOTES = {
+    'MySQL': [("'", "'"), ('"', '"')],
+    'Postgres': [("'", "'"), ("E'", "'"), ("e'", "'")],
+}
 
 
 class Macro:
@@ -12,28 +27,197 @@ class Macro:
 
 
 class DateMacro(Macro):
+    pattern = r"<DATEID(-)?(\d+)?>"
+
+    def macro_date(self, re_comp, today=None):
+        if re_comp.groups()[1] is None:
+            days_delta = 0
+        else:
+            days_delta = int(re_comp.groups()[1])
+        if re_comp.groups()[0] is not None:
+            days_delta = -1 * days_delta
+        return (today or date.today()) + timedelta(days=days_delta)
+
     def replace_text(self, text):
-        pattern = r"<DATEID(-)?(\d+)?>"
-        while re.search(pattern, text) is not None:
-            re_comp = re.search(pattern, text)
-            if re_comp.groups()[1] is None:
-                days_delta = 0
-            else:
-                days_delta = int(re_comp.groups()[1])
-            if re_comp.groups()[0] is not None:
-                days_delta = -1 * days_delta
-            d = timedelta(days=days_delta)
-            date_replace = str(date.today() + d)
-            text = re.sub(re_comp.group(), date_replace, text)
-        return text
+        today = date.today()
+        return re.sub(
+            self.pattern, lambda m: str(self.macro_date(m, today)), text)
+
+    def earliest(self, text):
+        """
+        Returns (macro, date) for the macro furthest in the past, None if
+        the text has no date macros
+        """
+        matches = list(re.finditer(self.pattern, text))
+        if not matches:
+            return None
+        re_comp = min(matches, key=self.macro_date)
+        return (re_comp.group(), self.macro_date(re_comp))
 
 
 class TableMacro(Macro):
+    pattern = r"<TABLE-(\d+)>"
+
     def replace_text(self, text, table_id_dict={}):
-        pattern = r"<TABLE-(\d+)>"
-        while re.search(pattern, text) is not None:
-            re_comp = re.search(pattern, text)
-            query_id = int(re_comp.groups()[0])
-            replace_text = table_id_dict[query_id]
-            text = re.sub(re_comp.group(), replace_text, text)
-        return text
+        return re.sub(
+            self.pattern, lambda m: table_id_dict[int(m.group(1))], text)
+
+
+class MacroTemplate:
+    """
+    Query text parsed once into literal segments and placeholders for
+    parameters, <DATEID-n> and <TABLE-n> so it renders in a single pass
+    """
+
+    def __init__(self, text, parameter_keys=()):
+        keys = sorted(set(k for k in parameter_keys if k), key=len,
+                      reverse=True)
+        # Parameters win over macros, as they used to be replaced first
+        alternatives = []
+        if keys:
+            alternatives.append(
+                '(?P<parameter>%s)' % '|'.join(re.escape(k) for k in keys))
+        alternatives.append(r'(?P<date><DATEID(?P<sign>-)?(?P<days>\d+)?>)')
+        alternatives.append(r'(?P<table><TABLE-(?P<table_id>\d+)>)')
+        self.segments = []
+        position = 0
+        for re_comp in re.finditer('|'.join(alternatives), text):
+            if re_comp.start() > position:
+                self.segments.append(text[position:re_comp.start()])
+            if re_comp.group('parameter') is not None:
+                placeholder = ('parameter', re_comp.group())
+            elif re_comp.group('date') is not None:
+                days_delta = int(re_comp.group('days') or 0)
+                if re_comp.group('sign') is not None:
+                    days_delta = -1 * days_delta
+                placeholder = ('date', days_delta, re_comp.group())
+            else:
+                placeholder = ('table', int(re_comp.group('table_id')),
+                               re_comp.group())
+            self.segments.append(placeholder)
+            position = re_comp.end()
+        if position < len(text):
+            self.segments.append(text[position:])
+        # placeholder_contexts by database type
+        self.contexts = {}
+
+    def render(self, parameters={}, dates=True, table_id_dict=None):
+        """
+        Returns the text with parameters replaced by their values
+        Date macros, also those in parameter values, are replaced unless
+        dates is False, tables are kept unless table_id_dict is given
+        """
+        today = date.today()
+        date_macro = DateMacro()
+        out = []
+        for segment in self.segments:
+            if not isinstance(segment, tuple):
+                out.append(segment)
+            elif segment[0] == 'parameter':
+                value = parameters[segment[1]]
+                if dates and '<DATEID' in value:
+                    value = date_macro.replace_text(value)
+                out.append(value)
+            elif segment[0] == 'date':
+                if dates:
+                    out.append(str(today + timedelta(days=segment[1])))
+                else:
+                    out.append(segment[2])
+            elif table_id_dict is not None:
+                out.append(table_id_dict[segment[1]])
+            else:
+                out.append(segment[2])
+        return ''.join(out)
+
+    def placeholder_contexts(self, db_type='MySQL'):
+        """
+        Returns for each segment None for text and placeholders in the SQL
+        itself, 'inline' for placeholders inside a longer string, quoted
+        identifier or comment, and (before, after), the lengths of the
+        quotes around a placeholder that is a whole string literal
+        """
+        contexts = self.contexts.get(db_type)
+        if contexts is not None:
+            return contexts
+        raw = [s[-1] if isinstance(s, tuple) else s for s in self.segments]
+        text = ''.join(raw)
+        tokens = list(fingerprint.spans(text, db_type))
+        starts = [t[1] for t in tokens]
+        quotes = STRING_QUOTES.get(db_type, STRING_QUOTES['MySQL'])
+        contexts = []
+        end = 0
+        for segment, segment_text in zip(self.segments, raw):
+            start, end = end, end + len(segment_text)
+            context = None
+            if isinstance(segment, tuple):
+                kind, token_start, token_end = tokens[
+                    bisect.bisect_right(starts, start) - 1]
+                if kind in ('literal', 'comment') and \
+                        token_start < start and end <= token_end:
+                    around = (text[token_start:start], text[end:token_end])
+                    if kind == 'literal' and around in quotes:
+                        context = (len(around[0]), len(around[1]))
+                    else:
+                        context = 'inline'
+            contexts.append(context)
+        self.contexts[db_type] = contexts
+        return contexts
+
+    def render_bound(self, parameters={}, dates=True, db_type='MySQL'):
+        """
+        Returns (text, values) with parameters as %s bind placeholders and
+        % escaped everywhere else
+        Quotes around a parameter are dropped since the driver quotes the
+        value, parameters inside a longer string literal, quoted identifier
+        or comment are spliced in
+        """
+        today = date.today()
+        date_macro = DateMacro()
+        out = []
+        values = []
+        strip_quote = 0
+        for segment, context in zip(self.segments,
+                                    self.placeholder_contexts(db_type)):
+            if not isinstance(segment, tuple):
+                out.append(segment[strip_quote:].replace('%', '%%'))
+                strip_quote = 0
+            elif segment[0] == 'parameter':
+                value = parameters[segment[1]]
+                if dates and isinstance(value, basestring) and \
+                        '<DATEID' in value:
+                    value = date_macro.replace_text(value)
+                if context == 'inline':
+                    out.append(unicode(value).replace('%', '%%'))
+                    continue
+                if context is not None:
+                    out[-1] = out[-1][:-context[0]]
+                    strip_quote = context[1]
+                out.append('%s')
+                values.append(value)
+            elif segment[0] == 'date':
+                if dates:
+                    out.append(str(today + timedelta(days=segment[1])))
+                else:
+                    out.append(segment[2])
+            else:
+                out.append(segment[2])
+        return (''.join(out), values)
+
+
+def get_template(key, text, parameter_keys=()):
+    """
+    Returns the compiled template of text, kept under key which has to
+    change whenever text does, e.g. (query id, modified time)
+    """
+    key = (key, frozenset(parameter_keys))
+    with _templates_lock:
+        template = _templates.pop(key, None)
+        if template is not None:
+            _templates[key] = template
+            return template
+    template = MacroTemplate(text, parameter_keys)
+    with _templates_lock:
+        _templates[key] = template
+        while len(_templates) > TEMPLATE_CACHE_SIZE:
+            _templates.popitem(last=False)
+    return template
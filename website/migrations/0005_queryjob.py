@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('website', '0004_auto_20150518_0343'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('parameters', models.TextField(default=b'{}')),
+                ('state', models.CharField(default=b'queued', max_length=10, choices=[(b'queued', b'queued'), (b'running', b'running'), (b'done', b'done'), (b'failed', b'failed')])),
+                ('progress', models.FloatField(default=0.0)),
+                ('submit_time', models.DateTimeField(auto_now_add=True)),
+                ('start_time', models.DateTimeField(null=True, blank=True)),
+                ('end_time', models.DateTimeField(null=True, blank=True)),
+                ('execution_time', models.FloatField(default=0.0)),
+                ('table_name', models.CharField(max_length=128, blank=True)),
+                ('cached', models.BooleanField(default=False)),
+                ('error', models.TextField(blank=True)),
+                ('query', models.ForeignKey(to='website.Query')),
+                ('user', models.ForeignKey(to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0005_queryjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='db',
+            name='statement_timeout',
+            field=models.IntegerField(help_text=b'Seconds a query may run before it is killed', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='query',
+            name='statement_timeout',
+            field=models.IntegerField(help_text=b'Seconds this query may run, overrides the database', null=True, blank=True),
+            preserve_default=True,
+        ),
+    ]
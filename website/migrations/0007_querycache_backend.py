@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0006_statement_timeout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='querycache',
+            name='backend',
+            field=models.CharField(default=b'mysql', help_text=b'Where the cached result is stored', max_length=10, choices=[(b'mysql', b'mysql'), (b'file', b'file')]),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0007_querycache_backend'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='querycache',
+            name='byte_size',
+            field=models.BigIntegerField(default=0, help_text=b'Memory used by the result, bytes'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='querycache',
+            name='column_schema',
+            field=models.TextField(default=b'[]', help_text=b'JSON list of [column, type]'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='querycache',
+            name='hit_count',
+            field=models.IntegerField(default=0),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='querycache',
+            name='last_access',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='querycache',
+            name='row_count',
+            field=models.IntegerField(default=0),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='querycache',
+            name='hash',
+            field=models.CharField(max_length=64),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='querycache',
+            index_together=set([('query', 'hash')]),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0008_querycache_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='db',
+            name='cache_stale_ttl',
+            field=models.IntegerField(help_text=b'Seconds after going stale a cached result is still served while it is refreshed', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='db',
+            name='cache_ttl',
+            field=models.IntegerField(help_text=b'Seconds cached results stay fresh', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='query',
+            name='cache_stale_ttl',
+            field=models.IntegerField(help_text=b'Seconds after going stale a cached result is still served while it is refreshed, overrides the database', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='query',
+            name='cache_ttl',
+            field=models.IntegerField(help_text=b'Seconds cached results stay fresh, overrides the database', null=True, blank=True),
+            preserve_default=True,
+        ),
+    ]
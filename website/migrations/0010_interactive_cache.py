@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0009_cache_ttl'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='querycache',
+            name='db',
+            field=models.ForeignKey(blank=True, to='website.Db', null=True),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='querycache',
+            name='query',
+            field=models.ForeignKey(blank=True, to='website.Query', null=True),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='querycache',
+            index_together=set([('db', 'hash'), ('query', 'hash')]),
+        ),
+    ]
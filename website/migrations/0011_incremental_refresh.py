@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0010_interactive_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='query',
+            name='incremental_column',
+            field=models.CharField(default='', help_text=b'Date column rows are only ever appended on.  Refreshes then only fetch rows from the last cached date on, the earliest <DATEID-N> must be an inclusive lower bound', max_length=64, blank=True),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='querycache',
+            name='template_hash',
+            field=models.CharField(default='', max_length=64, blank=True),
+            preserve_default=False,
+        ),
+        migrations.AlterIndexTogether(
+            name='querycache',
+            index_together=set([('query', 'template_hash'), ('db', 'hash'), ('query', 'hash')]),
+        ),
+    ]
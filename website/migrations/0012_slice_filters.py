@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0011_incremental_refresh'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='querydefault',
+            name='filter_column',
+            field=models.CharField(default='', help_text=b'Filter the cached result on this column instead of replacing search_for in the query, which then runs once for every value.  A blank value returns every row', max_length=64, blank=True),
+            preserve_default=False,
+        ),
+    ]
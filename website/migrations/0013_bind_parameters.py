@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0012_slice_filters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='query',
+            name='bind_parameters',
+            field=models.BooleanField(default=False, help_text=b'Send parameters to the database as bind parameters instead of pasting them into the query.  Quotes around a parameter are dropped'),
+            preserve_default=True,
+        ),
+    ]
@@ -1,16 +1,22 @@
 from django.db import models
 from django.utils import timezone
-from django.contrib.auth.models import User
+from django.contrib.auth.models import User, Group
 from encrypted_fields import EncryptedCharField
 from django.core.exceptions import ValidationError
 from taggit.managers import TaggableManager
+from taggit.models import Tag, TaggedItem
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from dateutil.relativedelta import relativedelta
 import re
 import time
 import json
 import query
+import get_db_engine
+import result_cache
+import payload_cache
+import definition_cache
+import acl_cache
 
 
 class Db(models.Model):
@@ -27,6 +33,16 @@ class Db(models.Model):
     username = models.CharField(max_length=128)
     password_encrypted = EncryptedCharField(
         max_length=1024,)  # TODO FIX SPELLING MISTAKE
+    statement_timeout = models.IntegerField(
+        null=True, blank=True,
+        help_text='Seconds a query may run before it is killed')
+    cache_ttl = models.IntegerField(
+        null=True, blank=True,
+        help_text='Seconds cached results stay fresh')
+    cache_stale_ttl = models.IntegerField(
+        null=True, blank=True,
+        help_text='Seconds after going stale a cached result is still '
+                  'served while it is refreshed')
     create_time = models.DateTimeField(auto_now_add=True, editable=False)
     modified_time = models.DateTimeField(auto_now=True, editable=False)
     tags = TaggableManager(blank=True)
@@ -80,6 +96,26 @@ class Query(models.Model):
         max_length=2048, blank=True)
     cacheable = models.BooleanField(
         default=True, help_text='allows this query result to be cached')
+    statement_timeout = models.IntegerField(
+        null=True, blank=True,
+        help_text='Seconds this query may run, overrides the database')
+    cache_ttl = models.IntegerField(
+        null=True, blank=True,
+        help_text='Seconds cached results stay fresh, overrides the database')
+    cache_stale_ttl = models.IntegerField(
+        null=True, blank=True,
+        help_text='Seconds after going stale a cached result is still '
+                  'served while it is refreshed, overrides the database')
+    bind_parameters = models.BooleanField(
+        default=False,
+        help_text='Send parameters to the database as bind parameters '
+                  'instead of pasting them into the query.  Quotes around '
+                  'a parameter are dropped')
+    incremental_column = models.CharField(
+        max_length=64, blank=True,
+        help_text='Date column rows are only ever appended on.  Refreshes '
+                  'then only fetch rows from the last cached date on, the '
+                  'earliest <DATEID-N> must be an inclusive lower bound')
     tags = TaggableManager(blank=True)
 
     def __unicode__(self):
@@ -152,6 +188,11 @@ class QueryDefault(models.Model):
                                      ('String', 'String'),
                                      ('Date', 'Date')),
                                  default='String')
+    filter_column = models.CharField(
+        max_length=64, blank=True,
+        help_text='Filter the cached result on this column instead of '
+                  'replacing search_for in the query, which then runs once '
+                  'for every value.  A blank value returns every row')
 
     def __str__(self):
         return "%s : %s " % (self.query, self.search_for[0:10])
@@ -220,16 +261,41 @@ class DashboardQuery(models.Model):
 
 
 class QueryCache(models.Model):
-    query = models.ForeignKey(Query)
+
+    class Meta:
+        index_together = [
+            ['query', 'hash'], ['db', 'hash'], ['query', 'template_hash']]
+    # Interactive queries are cached without a query, per database
+    query = models.ForeignKey(Query, null=True, blank=True)
+    db = models.ForeignKey(Db, null=True, blank=True)
     table_name = models.CharField(unique=True, max_length=128)
     run_time = models.DateTimeField(auto_now=True, editable=False)
-    hash = models.CharField(max_length=1024)
+    hash = models.CharField(max_length=64)
+    # Hash of the query before date macros, the same across days
+    template_hash = models.CharField(max_length=64, blank=True)
+    row_count = models.IntegerField(default=0)
+    byte_size = models.BigIntegerField(
+        default=0, help_text='Memory used by the result, bytes')
+    column_schema = models.TextField(
+        default='[]', help_text='JSON list of [column, type]')
+    hit_count = models.IntegerField(default=0)
+    last_access = models.DateTimeField(default=timezone.now)
+    backend = models.CharField(max_length=10,
+                               choices=(('mysql', 'mysql'), ('file', 'file')),
+                               default='mysql',
+                               help_text='Where the cached result is stored')
 
     def __str__(self):
         return "%s : %s : %s" % (self.query, self.table_name, self.run_time)
 
-    def is_expired(self, days_back=-1):
-        if self.run_time < timezone.now() + relativedelta(days=days_back):
+    def is_expired(self, ttl=None):
+        """
+        True if the result is older than ttl seconds, settings.CACHE_TTL
+        by default
+        """
+        if ttl is None:
+            ttl = getattr(settings, 'CACHE_TTL', 86400)
+        if self.run_time < timezone.now() - relativedelta(seconds=ttl):
             return True
         else:
             return False
@@ -246,6 +312,81 @@ class QueryView(models.Model):
         return "%s : %s : %s" % (self.user, self.query, self.view_time)
 
 
+class QueryJob(models.Model):
+    query = models.ForeignKey(Query)
+    user = models.ForeignKey(User)
+    parameters = models.TextField(default='{}')
+    state = models.CharField(max_length=10,
+                             choices=(
+                                 ('queued', 'queued'),
+                                 ('running', 'running'),
+                                 ('done', 'done'),
+                                 ('failed', 'failed')),
+                             default='queued')
+    progress = models.FloatField(default=0.0)
+    submit_time = models.DateTimeField(auto_now_add=True, editable=False)
+    start_time = models.DateTimeField(null=True, blank=True)
+    end_time = models.DateTimeField(null=True, blank=True)
+    execution_time = models.FloatField(default=0.0)
+    table_name = models.CharField(max_length=128, blank=True)
+    cached = models.BooleanField(default=False)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return "%s : %s : %s" % (self.query, self.user, self.state)
+
+
+def post_save_handler_db(sender, instance, **kwargs):
+    # Connection details may have changed, drop the pooled engine
+    get_db_engine.dispose_source_engine(instance.id)
+post_save.connect(post_save_handler_db, sender=Db)
+
+
+def post_change_handler_querycache(sender, instance, **kwargs):
+    # The cache table was rewritten or dropped, forget results read from it
+    result_cache.invalidate_table(instance.table_name)
+    payload_cache.invalidate_table(instance.table_name)
+post_save.connect(post_change_handler_querycache, sender=QueryCache)
+post_delete.connect(post_change_handler_querycache, sender=QueryCache)
+
+
+def post_change_handler_definition(sender, instance, **kwargs):
+    # Forget cached query definitions read from the changed row
+    if sender is Query:
+        definition_cache.invalidate(instance.id)
+    elif sender is QueryDefault:
+        definition_cache.invalidate(instance.query_id)
+    else:
+        # Databases, precedents and tags can be shared by many queries
+        definition_cache.clear()
+for definition_sender in (Query, QueryDefault, QueryPrecedent, Db, TaggedItem,
+                          Tag):
+    post_save.connect(post_change_handler_definition, sender=definition_sender)
+    post_delete.connect(post_change_handler_definition,
+                        sender=definition_sender)
+
+
+def post_change_handler_acl(sender, instance, **kwargs):
+    # Forget permission decisions the changed row took part in
+    if sender is User:
+        acl_cache.invalidate_user(instance.id)
+    else:
+        acl_cache.clear()
+for acl_sender in (User, Group, Query, Db, TaggedItem, Tag):
+    post_save.connect(post_change_handler_acl, sender=acl_sender)
+    post_delete.connect(post_change_handler_acl, sender=acl_sender)
+
+
+def m2m_changed_handler_groups(sender, instance, action, reverse, **kwargs):
+    # Group memberships changed, from the user's side unless reverse
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if reverse:
+            acl_cache.clear()
+        else:
+            acl_cache.invalidate_user(instance.id)
+m2m_changed.connect(m2m_changed_handler_groups, sender=User.groups.through)
+
+
 def post_save_handler_query(sender, instance, **kwargs):
     # POST SAVE TO CREATE IMAGE FOR QUERY
     post_save.disconnect(post_save_handler_query, sender=Query)
@@ -0,0 +1,102 @@
+from django.conf import settings
+from collections import OrderedDict
+
+import gzip
+import hashlib
+import threading
+from cStringIO import StringIO
+
+# Process wide LRU of serialized query API responses keyed on the identity
+# of the cached result and how it was manipulated, see
+# RunQuery.payload_identity, holding (body, gzipped body or None)
+_entries = OrderedDict()
+_entries_lock = threading.Lock()
+_total_bytes = 0
+
+
+def get_budget():
+    """
+    Returns the number of bytes the cache may hold, 0 disables it
+    """
+    return getattr(settings, 'PAYLOAD_CACHE_BYTES', 0)
+
+
+def compress(body):
+    """
+    Returns body gzipped once it is large enough to be worth it
+    """
+    if not getattr(settings, 'PAYLOAD_CACHE_GZIP', True) or len(body) < 1024:
+        return None
+    buf = StringIO()
+    with gzip.GzipFile(mode='wb', compresslevel=6, fileobj=buf) as f:
+        f.write(body)
+    return buf.getvalue()
+
+
+def etag(identity):
+    """
+    Returns the entity tag of responses with this identity
+    """
+    return hashlib.md5(repr(identity)).hexdigest()
+
+
+def get(identity):
+    """
+    Returns (body, gzipped body or None) for an identity or None
+    """
+    with _entries_lock:
+        payload = _entries.pop(identity, None)
+        if payload is not None:
+            _entries[identity] = payload
+        return payload
+
+
+def put(identity, body):
+    """
+    Caches a response body, evicting the least recently used responses
+    until the cache fits in its budget
+    returns (body, gzipped body or None)
+    """
+    global _total_bytes
+    payload = (body, compress(body))
+    size = payload_size(payload)
+    budget = get_budget()
+    if size > budget:
+        return payload
+    with _entries_lock:
+        _remove(identity)
+        while _entries and _total_bytes + size > budget:
+            _remove(next(iter(_entries)))
+        _entries[identity] = payload
+        _total_bytes += size
+    return payload
+
+
+def payload_size(payload):
+    return len(payload[0]) + len(payload[1] or '')
+
+
+def invalidate_table(table_name):
+    """
+    Drops every response built from a cache table
+    """
+    with _entries_lock:
+        for identity in _entries.keys():
+            if identity[2] == table_name:
+                _remove(identity)
+
+
+def clear():
+    """
+    Empties the cache
+    """
+    with _entries_lock:
+        for identity in _entries.keys():
+            _remove(identity)
+
+
+def _remove(identity):
+    global _total_bytes
+    payload = _entries.pop(identity, None)
+    if payload is not None:
+        _total_bytes -= payload_size(payload)
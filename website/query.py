@@ -1,33 +1,56 @@
 from django.conf import settings
-from django.shortcuts import get_object_or_404
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
 
 import logging
+import hashlib
 import pandas as pd
 import uuid
 import re
+import MySQLdb.cursors
+from multiprocessing.pool import ThreadPool
+from sqlalchemy import text
 
-import sqlalchemy
 import os
 import json
 import subprocess
 import copy
-import hashlib
+import decimal
+import datetime
 import models
 import get_db_engine
+import locks
+import fingerprint
+import definition_cache
+import acl_cache
+import result_cache
+import cache_backend
+import cache_writer
+import jobs
 import time
-from macro import Macro, DateMacro, TableMacro
-from urllib import quote_plus as urlquote
+import macro
+from macro import DateMacro, TableMacro
 
 from date_time_encoder import DateTimeEncoder
 logger = logging.getLogger(__name__)
 MAX_DEPTH_RECURSION = 10
+COLUMN_DTYPES = {
+    'b': 'boolean', 'i': 'integer', 'u': 'integer', 'f': 'float',
+    'M': 'datetime', 'm': 'timedelta'}
+
+
+class NoDataError(Exception):
+    """
+    Raised when a query returns no rows
+    """
 
 
 class Query:
 
     def __init__(self, query_text, db, depth=0, user=None,
                  query_id=None, query_model=None, parameters=None,
-                 cacheable=True):
+                 cacheable=True, stream=None, force_refresh=False):
         self.query_text = query_text
         self.db = db
         self.query_id = query_id
@@ -36,6 +59,19 @@ class Query:
         self.query_model = query_model
         self.parameters = parameters
         self.cacheable = cacheable
+        self.stream = stream
+        self.force_refresh = force_refresh
+        self.cache_stale = False
+        self.safety_prepared = False
+        self.precedent_run = None
+        self.cache_id = None
+        self.cache_run_time = None
+        self.cache_backend_name = None
+        self.window_template = None
+        self.template_hash = None
+        self.precedent_table_names = {}
+        self.slice_filters = []
+        self.bind_values = None
         if depth > MAX_DEPTH_RECURSION:
             raise IOError("Recursion Limit Reached")
 
@@ -76,16 +112,21 @@ class Query:
         Adds comments before query for the DBAs to blame
         """
         comment_char = {'MySQL': '#', 'Postgres': '--', 'Hive': '--'}
-        self.query_text = "%s sqlviz Running Query Id: %s \n %s" % (
+        self.query_text = "%s sqlviz Running Query Id: %s User: %s \n %s" % (
             comment_char[self.db.type],
             self.query_id,
+            getattr(self.user, 'id', None),
             self.query_text)
 
     def prepare_safety(self):
         """
         Runs safety check and adds limit if it is in the model
         Also saves hash before mutating query
+        Only runs once, later calls do nothing
         """
+        if self.safety_prepared:
+            return
+        self.safety_prepared = True
         self.check_safety()
         self.run_query_hash()
         if self.query_model is not None:
@@ -97,11 +138,12 @@ class Query:
 class LoadQuery:
 
     def __init__(self, query_id, user, cacheable=None,
-                 parameters={}):
+                 parameters={}, force_refresh=False):
         self.query_id = query_id
         self.user = user
         self.cacheable = cacheable
         self.parameters = parameters
+        self.force_refresh = string_to_boolean(force_refresh)
 
     def load_query(self):
         """
@@ -109,7 +151,8 @@ class LoadQuery:
         Set parameters
         create Query Object
         """
-        query = get_object_or_404(models.Query, pk=self.query_id)
+        self.definition = definition_cache.get(self.query_id)
+        query = self.definition.query
         # Manipulate is the final form of Query
         if self.cacheable is None:  # User has not set
             self.cacheable = query.cacheable
@@ -118,7 +161,8 @@ class LoadQuery:
         self.query = ManipulateData(
             query_text=query.query_text, db=query.db, user=self.user,
             query_id=self.query_id, query_model=query,
-            parameters=self.parameters, cacheable=self.cacheable)
+            parameters=self.parameters, cacheable=self.cacheable,
+            force_refresh=self.force_refresh)
 
     def parameters_find(self):
         """
@@ -126,8 +170,7 @@ class LoadQuery:
         those defaults that are over-riden by client values Get values
         from DB
         """
-        preset_parameters = models.QueryDefault.objects.filter(
-            query_id=self.query_id)
+        preset_parameters = self.definition.defaults
         target_parameters = {}
         # if self.parameters is not None:
         for parameter in preset_parameters:  # self.parameters:
@@ -143,26 +186,64 @@ class LoadQuery:
             target_parameters[parameter.search_for] = {
                 'data_type': parameter.data_type,
                 'search_for': parameter.search_for,
-                'replace_with': replace_with}
+                'replace_with': replace_with,
+                'filter_column': parameter.filter_column}
         self.target_parameters = target_parameters
 
     def parameters_replace(self):
         """
         For values in the target_parameters dict, update the query_text
-        Replace key with target_value
+        Replace key with target_value, in one pass over a template compiled
+        once per query version
 
         Macros
         ## <DATEID> ==> today regardles of what replace with is
         ## <TABLEID-1> ==> Table_name_guid regardless of replace with
         """
+        parameters = {}
+        data_types = {}
         for key, replacement_dict in self.target_parameters.iteritems():
-            macro = Macro(
-                key_pattern=replacement_dict['search_for'],
-                replace_value=str(replacement_dict['replace_with'])
-            )
-            self.query.query_text = macro.replace_text(self.query.query_text)
-        date_macro = DateMacro()
-        self.query.query_text = date_macro.replace_text(self.query.query_text)
+            if replacement_dict.get('filter_column'):
+                # Sliced from the cached result instead, see slice_data
+                if unicode(replacement_dict['replace_with']) != '':
+                    self.query.slice_filters.append((
+                        replacement_dict['filter_column'],
+                        replacement_dict['data_type'],
+                        unicode(replacement_dict['replace_with'])))
+                continue
+            parameters[replacement_dict['search_for']] = unicode(
+                replacement_dict['replace_with'])
+            data_types[replacement_dict['search_for']] = \
+                replacement_dict['data_type']
+        self.query.slice_filters.sort()
+        query_model = self.query.query_model
+        template = macro.get_template(
+            (self.query_id, query_model.modified_time),
+            self.query.query_text, parameters.keys())
+        bound = None
+        db_type = getattr(self.query.db, 'type', 'MySQL')
+        if query_model.bind_parameters:
+            bound = dict(
+                (key, bind_value(value, data_types[key]))
+                for key, value in parameters.iteritems())
+            query_text, bind_values = template.render_bound(
+                bound, db_type=db_type)
+            if bind_values:
+                self.query.query_text = query_text
+                self.query.bind_values = bind_values
+            else:
+                bound = None
+        if bound is None:
+            self.query.query_text = template.render(parameters)
+        if query_model.incremental_column:
+            if bound is None:
+                window_template = template.render(parameters, dates=False)
+            else:
+                window_template = template.render_bound(
+                    bound, dates=False, db_type=db_type)[0]
+            if DateMacro().earliest(window_template) is not None:
+                # Kept to rebuild the query for only the newest dates
+                self.query.window_template = window_template
 
     def get_parameters(self):
         return self.target_parameters
@@ -174,15 +255,51 @@ class LoadQuery:
         return self.query
 
 
+class PrecedentRun:
+    """
+    State shared by every query taking part in one precedent execution
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.guid = uuid.uuid1()
+        self.table_names = {}
+
+
 class RunQuery(Query):
 
     def run_query_hash(self):
-        m = hashlib.md5()
-        m.update(self.query_text)
-        self.query_hash = m.hexdigest()
+        """
+        Fingerprints the query text so formatting does not change the key
+        its cache is found by
+        """
+        db_type = getattr(self.db, 'type', 'MySQL')
+        self.query_hash = self.values_hash(
+            fingerprint.fingerprint(self.query_text, db_type))
+        if self.window_template is not None:
+            self.template_hash = self.values_hash(
+                fingerprint.fingerprint(self.window_template, db_type))
         # logging.warning(self.query_hash)
         return self.query_hash
 
+    def values_hash(self, text_hash):
+        """
+        Adds the bind parameter values to a hash of the query text
+        """
+        if self.bind_values is None:
+            return text_hash
+        return hashlib.md5(
+            text_hash + repr(self.bind_values)).hexdigest()
+
+    def cache_table_name(self):
+        """
+        Name of the table caching this query's result, interactive
+        queries are cached per database
+        """
+        if self.query_id is None:
+            return 'table_db%s_%s' % (self.db.id, self.query_hash)
+        return 'table_%s_%s' % (self.query_id, self.query_hash)
+
     def check_permission(self):
         """
         return true is user has permission on query, false otherwise
@@ -197,18 +314,17 @@ class RunQuery(Query):
         if self.user.is_superuser is True:
             # logging.warning("SUPER USER")
             return True
-        user_groups = set(self.user.groups.values_list('name', flat=True))
-        db_tags = set([str(i) for i in self.db.tags.all()])
         if self.query_model is None:  # Interactive Modes
+            db_tags = set([str(i) for i in self.db.tags.all()])
             query_tags = set()  # Give empty set
+            allowed, union_set = acl_cache.resolve(
+                acl_cache.user_groups(self.user), db_tags, query_tags)
         else:
-            query_tags = set([str(i) for i in self.query_model.tags.all()])
-        union_set = db_tags | query_tags
-        if len(union_set & user_groups) > 0:
-            # User tag is in either query or DB set
-            return True
-        elif len(db_tags) == 0:
-            # No Permissions set at either user or DB level
+            # Memoized per user and query, precedents check again
+            allowed, union_set = acl_cache.query_allowed(
+                self.user, self.query_model.id)
+        if allowed:
+            # User tag is in either query or DB set, or the DB is untagged
             return True
         else:
             raise Exception("""User does not have permission to view.
@@ -236,64 +352,182 @@ class RunQuery(Query):
     def return_data(self):
         return self.data
 
-    def save_to_mysql(self, table_name=None, batch_size=1000):
+    def save_to_mysql(self, table_name=None, backend=None):
         """
-        Writes output to MySQL table
-        Pandas is depricating this function.  TODO rewrite
+        Writes output to the cache, a MySQL table unless settings or
+        backend choose another cache backend
         """
         if self.cacheable is False:
             raise Exception("Trying to run Save on a non-cacheable query")
         if table_name is None:
             table_name = 'table_%s' % self.query_id
-        engine = get_db_engine.get_db_engine()
-        # TODO put in limits for data size (cols x rows to insert data)
-        self.data.to_sql(table_name, con=engine, if_exists='replace',
-                         index=False, chunksize=batch_size)
+        storage = cache_backend.get_cache_backend(backend)
+        storage.save(table_name, self.data)
+        byte_size = storage.size(table_name)
+        if byte_size is None:
+            byte_size = result_cache.data_size(self.data)
         # logging.warning('Save to MySQL')
+        metadata = {
+            'hash': self.query_hash,
+            # Precedent tables hold manipulated data, never append to them
+            'template_hash': (self.template_hash or '')
+            if table_name == self.cache_table_name() else '',
+            'backend': storage.name,
+            'row_count': len(self.data),
+            'byte_size': byte_size,
+            'column_schema': json.dumps([
+                [unicode(column), column_dtype(self.data.iloc[:, i])]
+                for i, column in enumerate(self.data.columns)]),
+            'last_access': timezone.now()}
         qc = models.QueryCache.objects.filter(
             query=self.query_model
         ).filter(table_name=table_name).first()
         # logging.warning(QC)
         if qc is None:
             # logging.warning('CREATE SOMETHING')
-            models.QueryCache.objects.create(query=self.query_model,
-                                             table_name=table_name,
-                                             hash=self.query_hash)
+            qc = models.QueryCache.objects.create(query=self.query_model,
+                                                  db=self.db,
+                                                  table_name=table_name,
+                                                  **metadata)
         else:
-            qc.hash = self.query_hash
+            if qc.backend != storage.name:
+                # The result moved, remove the copy in the old backend
+                cache_backend.get_cache_backend(qc.backend).drop(
+                    table_name)
+            for field, value in metadata.items():
+                setattr(qc, field, value)
             qc.save()
+        result_cache.put(
+            self.query_id, self.query_hash, table_name, qc.run_time,
+            self.data)
         return table_name
 
+    def precedent_graph(self):
+        """
+        Walks QueryPrecedent rows out from this query
+        returns dict of query id to the ids of its direct precedents
+        """
+        graph = {}
+        frontier = set([int(self.query_id)])
+        depth = 0
+        while frontier:
+            if depth > MAX_DEPTH_RECURSION:
+                raise IOError("Recursion Limit Reached")
+            for query_id in frontier:
+                graph[query_id] = list(
+                    definition_cache.get(query_id).precedent_ids)
+            frontier = set(
+                precedent_id
+                for query_id in frontier
+                for precedent_id in graph[query_id]
+            ) - set(graph)
+            depth += 1
+        return graph
+
+    def precedent_levels(self, graph):
+        """
+        Orders the precedents of graph into levels
+        Every query in a level only depends on queries in earlier levels
+        """
+        done = set()
+        remaining = set(graph) - set([int(self.query_id)])
+        levels = []
+        while remaining:
+            level = [i for i in remaining if set(graph[i]) <= done]
+            if len(level) == 0:
+                raise ValueError(
+                    "Cycle found in precedents of query %s" % self.query_id)
+            levels.append(level)
+            done.update(level)
+            remaining.difference_update(level)
+        return levels
+
     def run_precedents(self):
-        qp = models.QueryPrecedent.objects.filter(final_query_id=self.query_id)
-        run_guid = uuid.uuid1()
-
-        table_output_dict = {}
-        for i in qp:  # TODO could be parralelized???
-            logging.warning(i)
-            lq = LoadQuery(
-                query_id=i.preceding_query.id,
-                user=self.user,
-                parameters=self.parameters,
-                cacheable=True)
-            q = lq.prepare_query()
-            q.run_query()
-            if q.cached:
-                table_name = q.check_cache()
-                # logging.warning('CACHED TABLE NAME %s' % table_name)
-            else:
-                q.run_manipulations()
-                table_name = 'table_{id}_{guid}'.format(
-                    id=lq.query_id,
-                    guid=run_guid
-                )
-                q.save_to_mysql(table_name)
-            table_output_dict[lq.query_id] = table_name
-        return table_output_dict
+        """
+        Runs all precedents of this query once each
+        Independent precedents are run at the same time on a thread pool
+        returns dict of precedent query id to table name
+        """
+        if self.query_id is None:
+            return {}
+        if self.precedent_run is not None:
+            # Nested precedent, its own precedents have already been run
+            return dict(
+                (i, self.precedent_run.table_names[i])
+                for i in self.precedent_run.graph[int(self.query_id)]
+            )
+        graph = self.precedent_graph()
+        levels = self.precedent_levels(graph)
+        if len(levels) == 0:
+            return {}
+
+        precedent_run = PrecedentRun(graph)
+        pool_size = min(
+            getattr(settings, 'PRECEDENT_THREADS', 4),
+            max(len(level) for level in levels))
+        pool = ThreadPool(pool_size) if pool_size > 1 else None
+        try:
+            for level in levels:
+                if pool is None or len(level) == 1:
+                    results = [self.run_precedent(i, precedent_run)
+                               for i in level]
+                else:
+                    results = pool.map(
+                        lambda i: self.run_precedent_thread(i, precedent_run),
+                        level)
+                precedent_run.table_names.update(results)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return dict(
+            (i, precedent_run.table_names[i])
+            for i in graph[int(self.query_id)]
+        )
 
-    def run_query(self):
+    def run_precedent_thread(self, query_id, precedent_run):
+        """
+        run_precedent for worker threads, which each hold a DB connection
+        """
+        try:
+            return self.run_precedent(query_id, precedent_run)
+        finally:
+            connection.close()
+
+    def run_precedent(self, query_id, precedent_run):
+        """
+        Runs a single precedent query and saves its output
+        returns tuple of query id and table name
+        """
+        logging.warning('Running precedent %s' % query_id)
+        lq = LoadQuery(
+            query_id=query_id,
+            user=self.user,
+            parameters=self.parameters,
+            cacheable=True)
+        q = lq.prepare_query()
+        q.precedent_run = precedent_run
+        q.run_query()
+        if q.cached and not q.slice_filters and \
+                q.cache_backend_name == 'mysql':
+            # Only a MySQL cache table can be joined on by the final query
+            table_name = q.check_cache()
+            # logging.warning('CACHED TABLE NAME %s' % table_name)
+        else:
+            q.run_manipulations()
+            table_name = 'table_{id}_{guid}'.format(
+                id=lq.query_id,
+                guid=precedent_run.guid
+            )
+            # Queries join on precedent results so they must be tables
+            q.save_to_mysql(table_name, backend='mysql')
+        return (query_id, table_name)
+
+    def run_query(self, write_behind=True, record_view=True):
         """
         Wrapper for Run Query
+        write_behind returns before the result is saved to the cache
+        record_view saves a QueryView, background runs are not views
         """
         start_time = time.time()
 
@@ -301,103 +535,484 @@ class RunQuery(Query):
         self.check_permission()
 
         # Run Precedents
-        # TODO fix race conditiosn with precents/ cache
-        precedent_table_names = self.run_precedents()
+        self.precedent_table_names = self.run_precedents()
         # Run Table Name Macro
-        if precedent_table_names:
+        if self.precedent_table_names:
             # TODO run macro
             table_macro = TableMacro()
             self.query_text = table_macro.replace_text(
                 text=self.query_text,
-                table_id_dict=precedent_table_names
+                table_id_dict=self.precedent_table_names
             )
 
         # Attempt to use Cache
-        table_cache = self.check_cache()
+        table_cache = False if self.force_refresh else self.check_cache()
         # logging.warning('Cache Tables %s %s' % (table_cache, self.cacheable))
-        if table_cache and self.cacheable:
-            try:
-                self.retrieve_cache(table_cache)
-                self.cached = True
-                return self.data
-            except Exception, e:
-                logging.error("""CACHE IS MISSING FOR TABLE
-                        %s -- %s""" % (table_cache, str(e)))
-        # Get DB Type
-        if self.db.type in ['MySQL', 'Postgres']:
-            self.cached = False
-            self.data = self.run_sql_query()
-        elif self.db.type == 'Hive':
-            raise ValueError("HIVE NOT YET IMPLMENTED TODO")
-        else:
-            raise ValueError('DB Type not in MySQL, Postgres, Hive')
+        if self.load_cache(table_cache):
+            if self.cache_stale:
+                # Serve the stale result and refresh it for the next viewer
+                jobs.refresh_cache(self)
+            if record_view:
+                self.record_query_execution(
+                    used_cache=True, execution_time=time.time() - start_time)
+            return self.slice_data()
 
-        if len(self.data) == 0:
-            raise Exception("No Data Returned")
+        cache_lock = None
         if self.cacheable is True:
-            self.save_to_mysql(
-                'table_%s_%s' % (self.query_id, self.query_hash)
-            )
+            # Only one process runs the same query at a time, the others
+            # wait here and then read the cache it wrote
+            cache_lock = locks.AdvisoryLock(
+                'sqlviz_%s' % self.cache_table_name())
+            wait_time = timezone.now()
+            if cache_lock.acquire():
+                table_cache = self.check_cache(allow_stale=False)
+                if self.force_refresh and table_cache and \
+                        self.cache_run_time < wait_time:
+                    # Only a result written while we waited is fresh enough
+                    table_cache = False
+                if self.load_cache(table_cache):
+                    cache_lock.release()
+                    if record_view:
+                        self.record_query_execution(
+                            used_cache=True,
+                            execution_time=time.time() - start_time)
+                    return self.slice_data()
+        try:
+            # Get DB Type
+            if self.db.type in ['MySQL', 'Postgres']:
+                self.cached = False
+                self.data = None
+                if self.cacheable is True and not self.force_refresh:
+                    # Uncached and forced runs ask for every row afresh
+                    self.data = self.run_incremental()
+                if self.data is None:
+                    self.data = self.run_sql_query()
+            elif self.db.type == 'Hive':
+                raise ValueError("HIVE NOT YET IMPLMENTED TODO")
+            else:
+                raise ValueError('DB Type not in MySQL, Postgres, Hive')
+
+            if len(self.data) == 0:
+                raise Exception("No Data Returned")
+            if self.cacheable is True:
+                table_name = self.cache_table_name()
+                if write_behind and cache_writer.submit(
+                        self, table_name, cache_lock):
+                    # The writer releases the lock after saving
+                    cache_lock = None
+                else:
+                    self.save_to_mysql(table_name)
+        finally:
+            if cache_lock is not None:
+                cache_lock.release()
         execution_time = time.time() - start_time
-        self.record_query_execution(
-            used_cache=table_cache is None,
-            execution_time=execution_time
-        )
+        if record_view:
+            self.record_query_execution(
+                used_cache=False,
+                execution_time=execution_time
+            )
+        return self.slice_data()
+
+    def slice_data(self):
+        """
+        Filters the data on the query's sliced parameters, the cache holds
+        the rows of every value
+        returns the data
+        """
+        if not self.slice_filters:
+            return self.data
+        keep = pd.Series(True, index=self.data.index)
+        for column, data_type, value in self.slice_filters:
+            values = self.data[column]
+            if data_type == 'Numeric':
+                keep &= values.astype(float) == float(value)
+            elif data_type == 'Date':
+                keep &= pd.to_datetime(values) == pd.Timestamp(value)
+            else:
+                keep &= values.astype(unicode) == value
+        self.data = self.data[keep.values].reset_index(drop=True)
         return self.data
 
     def run_sql_query(self):
         """
         Runs SQL query in DB
         """
-        engine_string = '%s://%s:%s@%s:%s/%s' % (
-            self.db.type.lower(),
-            self.db.username,
-            urlquote(self.db.password_encrypted),
-            self.db.host,
-            self.db.port,
-            self.db.db
-        )
-        engine = sqlalchemy.create_engine(engine_string,)
+        if self.use_streaming():
+            return self.run_sql_query_streaming()
+        engine = get_db_engine.get_source_engine(self.db)
         c = engine.connect()
-        query_text = self.query_text.replace('%', '%%')  # SQLAlchemy Esc
-        result = c.execute(query_text)
-        df = pd.DataFrame(result.fetchall())
-
-        if df.shape == (0, 0):
-            raise Exception("No Data Returned by Query!")
-        df.columns = result.keys()
-        c.close()
+        try:
+            self.set_statement_timeout(c.connection)
+            if self.bind_values is None:
+                query_text = self.query_text.replace('%', '%%')  # SQLAlchemy
+                result = c.execute(query_text)
+            else:
+                result = c.execute(*self.bound_statement(c.connection))
+            df = pd.DataFrame(result.fetchall())
+
+            if df.shape == (0, 0):
+                raise NoDataError("No Data Returned by Query!")
+            df.columns = result.keys()
+        finally:
+            c.close()
         return df
 
+    def incremental_base(self):
+        """
+        Finds the newest cached result of this query's date window, which
+        may be from an earlier day
+        returns QueryCache or None
+        """
+        if self.template_hash is None or self.query_id is None:
+            return None
+        return models.QueryCache.objects.filter(
+            query_id=self.query_id, template_hash=self.template_hash
+        ).order_by('-run_time').first()
+
+    def incremental_query_text(self, since):
+        """
+        Rebuilds the query with the start of its date window moved to since
+        """
+        window_macro = DateMacro().earliest(self.window_template)[0]
+        query_text = self.query_text
+        self.query_text = DateMacro().replace_text(
+            self.window_template.replace(window_macro, str(since)))
+        try:
+            if self.query_model.insert_limit is True:
+                self.add_limit()
+            self.add_comment()
+            if self.precedent_table_names:
+                self.query_text = TableMacro().replace_text(
+                    text=self.query_text,
+                    table_id_dict=self.precedent_table_names)
+            return self.query_text
+        finally:
+            self.query_text = query_text
+
+    def run_incremental(self):
+        """
+        Runs an append only query for the dates after its newest cached
+        result, appends the new rows and trims rows older than the window
+        returns the data, None when the whole query has to be run
+        """
+        base = self.incremental_base()
+        if base is None:
+            return None
+        column = self.query_model.incremental_column
+        window_start = DateMacro().earliest(self.window_template)[1]
+        try:
+            cached = cache_backend.get_cache_backend(base.backend).load(
+                base.table_name)
+        except Exception, e:
+            logging.warning('Incremental base %s is missing -- %s' % (
+                base.table_name, str(e)))
+            return None
+        if column not in cached.columns or len(cached) == 0:
+            return None
+        dates = pd.to_datetime(cached[column])
+        since = dates.max()
+        if pd.isnull(since) or since.date() < window_start:
+            # Nothing cached overlaps today's window
+            return None
+        since = since.date()
+        query_text = self.query_text
+        self.query_text = self.incremental_query_text(since)
+        try:
+            new = self.run_sql_query()
+        except NoDataError:
+            # No rows since the newest cached date
+            new = cached.iloc[:0]
+        finally:
+            self.query_text = query_text
+        if list(new.columns) != list(cached.columns):
+            logging.warning('Columns of %s changed, running it in full' % (
+                self.query_id))
+            return None
+        # The newest cached dates may have been partial, they are re-read
+        new_start = pd.to_datetime(new[column]).min()
+        keep = dates >= pd.Timestamp(window_start)
+        if not pd.isnull(new_start):
+            keep &= dates < new_start
+        cached = cached[keep.values]
+        if dates.iloc[0] > dates.iloc[-1]:
+            # Keep descending results in order
+            frames = [new, cached]
+        else:
+            frames = [cached, new]
+        return pd.concat(frames, ignore_index=True)
+
+    def bound_statement(self, dbapi_connection):
+        """
+        Returns (statement, values) running the query with its bind
+        parameters.  On Postgres the query is prepared once per pooled
+        connection and run with EXECUTE, MySQLdb only binds client side
+        """
+        values = tuple(self.bind_values)
+        if self.db.type != 'Postgres':
+            return (self.query_text, values)
+        # Keep add_comment's comment on the EXECUTE so cancel finds it
+        comment, _, body = self.query_text.partition('\n')
+        if not body:
+            comment, body = '', comment
+        name = 'sqlviz_%s' % hashlib.md5(
+            body.encode('utf-8')).hexdigest()
+        prepared = dbapi_connection.info.setdefault('prepared', set())
+        if name not in prepared:
+            cursor = dbapi_connection.cursor()
+            try:
+                cursor.execute('PREPARE %s AS %s' % (
+                    name, numbered_placeholders(body)))
+            finally:
+                cursor.close()
+            # Keep the statement when the pool rolls back the connection
+            dbapi_connection.commit()
+            prepared.add(name)
+        return ('%s\n EXECUTE %s (%s)' % (
+            comment, name, ', '.join(['%s'] * len(values))), values)
+
+    def get_statement_timeout(self):
+        """
+        returns seconds the query may run for, the query's own setting
+        wins over its database's, None for no limit
+        """
+        if self.query_model is not None and \
+                self.query_model.statement_timeout:
+            return self.query_model.statement_timeout
+        return self.db.statement_timeout
+
+    def set_statement_timeout(self, dbapi_connection):
+        """
+        Sets the server side statement timeout of a pooled connection
+        Skipped when the connection already has the right timeout
+        """
+        timeout = self.get_statement_timeout() or 0
+        if dbapi_connection.info.get('statement_timeout', 0) == timeout:
+            return
+        if self.db.type == 'MySQL':
+            statement = 'SET SESSION max_execution_time = %d'
+        elif self.db.type == 'Postgres':
+            statement = 'SET statement_timeout = %d'
+        else:
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(statement % (timeout * 1000))
+        finally:
+            cursor.close()
+        if self.db.type == 'Postgres':
+            # Keep the setting when the pool rolls back the connection
+            dbapi_connection.commit()
+        dbapi_connection.info['statement_timeout'] = timeout
+
+    def cancel(self, all_users=False):
+        """
+        Kills statements running on the source database that are tagged
+        with this query id by add_comment, only this user's statements
+        unless all_users
+        returns number of statements cancelled
+        """
+        tag = 'sqlviz Running Query Id: %s User: ' % self.query_id
+        if not all_users:
+            tag += '%s ' % getattr(self.user, 'id', None)
+        engine = get_db_engine.get_source_engine(self.db)
+        c = engine.connect()
+        try:
+            if self.db.type == 'MySQL':
+                thread_ids = [r[0] for r in c.execute(
+                    text("""SELECT id FROM information_schema.processlist
+                        WHERE info LIKE :pattern
+                        AND id != CONNECTION_ID()"""),
+                    pattern='%' + tag + '%')]
+                for thread_id in thread_ids:
+                    c.execute('KILL QUERY %d' % thread_id)
+                return len(thread_ids)
+            elif self.db.type == 'Postgres':
+                return len(c.execute(
+                    text("""SELECT pg_cancel_backend(pid)
+                        FROM pg_stat_activity
+                        WHERE query LIKE :pattern
+                        AND pid <> pg_backend_pid()"""),
+                    pattern='%' + tag + '%').fetchall())
+            else:
+                raise ValueError("Can not cancel %s queries" % self.db.type)
+        finally:
+            c.close()
+
+    def use_streaming(self):
+        """
+        Unlimited queries can return very large results so are fetched
+        through a server side cursor unless told otherwise
+        """
+        if self.stream is not None:
+            return self.stream
+        return (self.query_model is not None and
+                self.query_model.insert_limit is False)
+
+    def server_side_cursor(self, dbapi_connection):
+        """
+        Returns a cursor which leaves the result set on the server
+        """
+        if self.db.type == 'MySQL':
+            return dbapi_connection.cursor(MySQLdb.cursors.SSCursor)
+        elif self.db.type == 'Postgres':
+            # Named cursors are server side in psycopg2
+            return dbapi_connection.cursor(name='sqlviz_%s' % uuid.uuid4().hex)
+        else:
+            raise ValueError('Streaming not supported for %s' % self.db.type)
+
+    def run_sql_query_streaming(self, chunk_size=None):
+        """
+        Runs SQL query in DB fetching rows in chunks from a server side
+        cursor, each chunk is turned into typed columns as it arrives
+        """
+        if chunk_size is None:
+            chunk_size = getattr(settings, 'STREAMING_FETCH_SIZE', 10000)
+        engine = get_db_engine.get_source_engine(self.db)
+        dbapi_connection = engine.raw_connection()
+        chunks = []
+        try:
+            cursor = self.server_side_cursor(dbapi_connection)
+            try:
+                self.set_statement_timeout(dbapi_connection)
+                if self.bind_values is None:
+                    # No bind parameters so % needs no escaping here
+                    cursor.execute(self.query_text)
+                else:
+                    # Named cursors can not DECLARE an EXECUTE
+                    cursor.execute(
+                        self.query_text, tuple(self.bind_values))
+                columns = [d[0] for d in cursor.description]
+                rows = cursor.fetchmany(chunk_size)
+                while rows:
+                    chunks.append(
+                        pd.DataFrame.from_records(list(rows), columns=columns)
+                    )
+                    rows = cursor.fetchmany(chunk_size)
+            finally:
+                cursor.close()
+        finally:
+            dbapi_connection.close()
+
+        if len(chunks) == 0:
+            raise NoDataError("No Data Returned by Query!")
+        return pd.concat(chunks, ignore_index=True)
+
     def get_cache_status(self):
         """
         Returns if query used cache
         """
         return self.cached
 
-    def check_cache(self):
+    def get_cache_ttl(self):
+        """
+        returns (ttl, stale_ttl) in seconds for this query
+        """
+        return cache_ttl(self.db, self.query_model)
+
+    def check_cache(self, allow_stale=True):
         """
         Checks to see if this query's cache matches
         another previous and fresh query_tags
+        Results within the stale window are allowed and set cache_stale
         returns table name / False
         """
+        if self.query_id is None:
+            # Interactive queries share a cache per database
+            owner = {'query__isnull': True, 'db': self.db}
+        else:
+            owner = {'query_id': self.query_id}
         qc = models.QueryCache.objects.filter(
-            query_id=self.query_id,
-            hash=self.query_hash).order_by('run_time').first()
+            hash=self.query_hash, **owner).order_by('run_time').first()
         if qc is None:
             return False
-        elif qc.is_expired():
+        ttl, stale_ttl = self.get_cache_ttl()
+        self.cache_stale = qc.is_expired(ttl)
+        # Only saved queries can be refreshed in the background
+        allow_stale = allow_stale and self.query_id is not None
+        if self.cache_stale and (
+                not allow_stale or qc.is_expired(ttl + stale_ttl)):
             return False
         else:
+            self.cache_id = qc.id
+            self.cache_run_time = qc.run_time
+            self.cache_backend_name = qc.backend
             return qc.table_name
 
-    def retrieve_cache(self, table_name):
+    def load_cache(self, table_cache):
+        """
+        Sets self.data from the cache table if the query may use the cache
+        returns True if the cache was used
+        """
+        if not (table_cache and self.cacheable):
+            return False
+        try:
+            self.retrieve_cache(
+                table_cache, self.cache_run_time, self.cache_backend_name)
+            self.cached = True
+            self.record_cache_hit()
+            return True
+        except Exception, e:
+            logging.error("""CACHE IS MISSING FOR TABLE
+                    %s -- %s""" % (table_cache, str(e)))
+            return False
+
+    def payload_identity(self, output_format='array'):
+        """
+        Finds the query's cache entry without loading it, after
+        prepare_safety
+        returns a tuple identifying the manipulated and serialized result,
+        None if the cache can not be used
+        """
+        if self.force_refresh or not self.cacheable:
+            return None
+        table_name = self.check_cache()
+        if not table_name:
+            return None
+        if self.query_model is None:
+            return (self.query_id, self.query_hash, table_name,
+                    self.cache_run_time, output_format)
+        return (self.query_id, self.query_hash, table_name,
+                self.cache_run_time, self.query_model.pivot_data,
+                self.query_model.cumulative, self.query_model.modified_time,
+                tuple(self.slice_filters), output_format)
+
+    def record_payload_hit(self):
+        """
+        Bookkeeping run_query would do for a cache hit when the serialized
+        response is reused instead
+        """
+        self.cached = True
+        self.record_cache_hit()
+        if self.cache_stale:
+            jobs.refresh_cache(self)
+        self.record_query_execution(used_cache=True)
+
+    def record_cache_hit(self):
+        """
+        Counts a use of the cache entry found by check_cache
+        """
+        models.QueryCache.objects.filter(id=self.cache_id).update(
+            hit_count=F('hit_count') + 1, last_access=timezone.now())
+
+    def retrieve_cache(self, table_name, run_time=None, backend=None):
         """
         sets self.data from the query's cache
+        Results are kept in memory when the cache run_time is known
         """
-        engine = get_db_engine.get_db_engine()
-        self.data = pd.read_sql_table(table_name, con=engine, coerce_float=True)
-        self.data = self.data.convert_objects(convert_numeric=True)
+        self.data = result_cache.get(
+            self.query_id, self.query_hash, table_name, run_time)
+        if self.data is not None:
+            return self.data
+        if backend is None:
+            qc = models.QueryCache.objects.filter(
+                table_name=table_name).first()
+            backend = qc.backend if qc is not None else 'mysql'
+        storage = cache_backend.get_cache_backend(backend)
+        self.data = storage.load(table_name)
+        if run_time is not None:
+            result_cache.put(
+                self.query_id, self.query_hash, table_name, run_time,
+                self.data)
         return self.data
 
 
@@ -436,12 +1051,30 @@ class ManipulateData(RunQuery):
         self.data = self.data.transpose()
 
     def pandas_to_array(self):
-        # logging.warning(self.data)
+        """
+        Returns the data as a header row followed by data rows
+        Values are converted to python types a column at a time
+        """
+        columns = [column_to_list(self.data.iloc[:, i])
+                   for i in range(len(self.data.columns))]
         self.data_array = [self.data.columns.tolist()]
-        self.data_array += [[v for v in r[1]] for r in self.data.iterrows()]
-        # logging.warning(self.data_array)
+        self.data_array += [list(r) for r in zip(*columns)]
         return self.data_array
 
+    def pandas_to_columns(self):
+        """
+        Returns the data as one list per column along with column dtypes
+        """
+        self.data_columns = {
+            'columns': self.data.columns.tolist(),
+            'dtypes': [],
+            'data': []}
+        for i in range(len(self.data.columns)):
+            column = self.data.iloc[:, i]
+            self.data_columns['dtypes'].append(column_dtype(column))
+            self.data_columns['data'].append(column_to_list(column))
+        return self.data_columns
+
     def html_table(self):
         """
         Returns a Pandas HTML Array from the data DataFrame
@@ -493,19 +1126,92 @@ class ManipulateData(RunQuery):
         subprocess.call([cli], shell=True)
         return output_image
 
-    def run_manipulations(self):
+    def run_manipulations(self, output_format='array'):
         """
         Gets Processing steps from DB and executes them in order
+        output_format of columnar builds data_columns instead of data_array
         """
-        query = models.Query.objects.filter(id=self.query_id).first()
+        query = self.query_model
 
-        if query.pivot_data is True:
+        if query is not None and query.pivot_data is True:
             self.pivot()
-        if query.cumulative is True:
+        if query is not None and query.cumulative is True:
             self.cumulative()
 
         self.numericalize_data()
-        self.pandas_to_array()
+        if output_format == 'columnar':
+            self.pandas_to_columns()
+        else:
+            self.pandas_to_array()
+
+
+def column_to_list(series):
+    """
+    Converts a DataFrame column to a list of native python values
+    Dates become datetimes, Decimals become floats, missing dates None
+    """
+    values = series.values
+    if values.dtype.kind == 'M':
+        return [None if v is pd.NaT else v
+                for v in pd.DatetimeIndex(series).to_pydatetime()]
+    elif values.dtype.kind == 'm':
+        return [v for v in series]
+    elif values.dtype.kind == 'O':
+        present = values[pd.notnull(values)]
+        if len(present) > 0 and isinstance(present[0], decimal.Decimal):
+            return [float(v) if isinstance(v, decimal.Decimal) else v
+                    for v in values]
+    return values.tolist()
+
+
+def column_dtype(series):
+    """
+    Returns a JSON friendly type name for a DataFrame column
+    """
+    kind = series.values.dtype.kind
+    if kind in COLUMN_DTYPES:
+        return COLUMN_DTYPES[kind]
+    present = series.values[pd.notnull(series.values)]
+    if len(present) == 0:
+        return 'string'
+    value = present[0]
+    if isinstance(value, (decimal.Decimal, float)):
+        return 'float'
+    elif isinstance(value, bool):
+        return 'boolean'
+    elif isinstance(value, (int, long)):
+        return 'integer'
+    elif isinstance(value, datetime.datetime):
+        return 'datetime'
+    elif isinstance(value, datetime.date):
+        return 'date'
+    return 'string'
+
+
+def bind_value(value, data_type):
+    """
+    Converts a parameter value to the type it is bound to the query as
+    """
+    if data_type == 'Numeric':
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+    return value
+
+
+def numbered_placeholders(statement):
+    """
+    Turns %s placeholders into Postgres' $1, $2 ... and unescapes %%
+    """
+    count = [0]
+
+    def placeholder(re_comp):
+        if re_comp.group() == '%%':
+            return '%'
+        count[0] += 1
+        return '$%d' % count[0]
+    return re.sub('%%|%s', placeholder, statement)
 
 
 def string_to_boolean(string='', default=False):
@@ -520,3 +1226,18 @@ def string_to_boolean(string='', default=False):
         return True
     else:
         return default
+
+
+def cache_ttl(db, query_model):
+    """
+    returns (ttl, stale_ttl) in seconds, the query's settings win over
+    its database's which win over settings.CACHE_TTL / CACHE_STALE_TTL
+    """
+    ttl = getattr(settings, 'CACHE_TTL', 86400)
+    stale_ttl = getattr(settings, 'CACHE_STALE_TTL', 0)
+    for model in (db, query_model):
+        if getattr(model, 'cache_ttl', None) is not None:
+            ttl = model.cache_ttl
+        if getattr(model, 'cache_stale_ttl', None) is not None:
+            stale_ttl = model.cache_stale_ttl
+    return (ttl, stale_ttl)
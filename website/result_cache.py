@@ -0,0 +1,101 @@
+from django.conf import settings
+from collections import OrderedDict
+
+import sys
+import threading
+
+# Process wide LRU of query results in front of the scratch tables
+# keyed on (query_id, query_hash), holding (table_name, run_time, data, size)
+_entries = OrderedDict()
+_entries_lock = threading.Lock()
+_total_bytes = 0
+
+
+def get_budget():
+    """
+    Returns the number of bytes the cache may hold, 0 disables it
+    """
+    return getattr(settings, 'RESULT_CACHE_BYTES', 0)
+
+
+def data_size(data):
+    """
+    Returns the memory used by a DataFrame in bytes
+    memory_usage only counts the pointers of object columns, the size of
+    the objects they point to is added
+    """
+    size = int(data.memory_usage(index=True).sum())
+    for i in range(data.shape[1]):
+        values = data.iloc[:, i].values
+        if values.dtype.kind == 'O':
+            size += sum(sys.getsizeof(v) for v in values)
+    return size
+
+
+def get(query_id, query_hash, table_name, run_time):
+    """
+    Returns a copy of the cached DataFrame if it was loaded from the same
+    cache table at the same run_time, otherwise None
+    """
+    if run_time is None:
+        # Nothing to check the entry against, leave it for other readers
+        return None
+    with _entries_lock:
+        entry = _entries.get((query_id, query_hash))
+        if entry is None:
+            return None
+        if entry[0] != table_name or entry[1] != run_time:
+            # The cache table was replaced, possibly by another process
+            _remove((query_id, query_hash))
+            return None
+        del _entries[(query_id, query_hash)]
+        _entries[(query_id, query_hash)] = entry
+        data = entry[2]
+    # Manipulations must not change the cached copy
+    return data.copy()
+
+
+def put(query_id, query_hash, table_name, run_time, data):
+    """
+    Caches a DataFrame, evicting the least recently used results
+    until the cache fits in its budget
+    """
+    global _total_bytes
+    budget = get_budget()
+    size = data_size(data)
+    if size > budget:
+        return False
+    with _entries_lock:
+        _remove((query_id, query_hash))
+        while _entries and _total_bytes + size > budget:
+            _remove(next(iter(_entries)))
+        _entries[(query_id, query_hash)] = (
+            table_name, run_time, data.copy(), size)
+        _total_bytes += size
+    return True
+
+
+def invalidate_table(table_name):
+    """
+    Drops every result loaded from a cache table
+    """
+    with _entries_lock:
+        for key, entry in _entries.items():
+            if entry[0] == table_name:
+                _remove(key)
+
+
+def clear():
+    """
+    Empties the cache
+    """
+    with _entries_lock:
+        for key in _entries.keys():
+            _remove(key)
+
+
+def _remove(key):
+    global _total_bytes
+    entry = _entries.pop(key, None)
+    if entry is not None:
+        _total_bytes -= entry[3]
@@ -7,6 +7,18 @@ urlpatterns = patterns('',
                        url(r'^$', index, name='home'),
                        url(r'^api/query/(?P<query_id>\d+)$',
                            query_api, name='query_api'),
+                       url(r'^api/query/(?P<query_id>\d+)/job$',
+                           query_job_submit, name='query_job_submit'),
+                       url(r'^api/query/(?P<query_id>\d+)/cancel$',
+                           query_cancel, name='query_cancel'),
+                       url(r'^api/job/(?P<job_id>\d+)$',
+                           query_job_status, name='query_job_status'),
+                       url(r'^api/job/(?P<job_id>\d+)/result$',
+                           query_job_result, name='query_job_result'),
+                       url(r'^api/query_batch/(?P<query_ids>[,\d]+)$',
+                           query_batch_api, name='query_batch_api'),
+                       url(r'^api/dashboard/(?P<dashboard_id>\d+)$',
+                           dashboard_api, name='dashboard_api'),
                        url(r'^query/(?P<query_ids>[,\d]+)$',
                            query_view, name='query'),
                        url(r'^query/(?P<query_names>[,\w ]+)$',
@@ -16,6 +28,9 @@ urlpatterns = patterns('',
                        url(r'^filter/', index, name='filter'),
                        url(r'^query_interactive/', query_interactive,
                            name='query_interactive'),
+                       url(r'^api/query_interactive/cancel$',
+                           query_interactive_cancel,
+                           name='query_interactive_cancel'),
                        url(r'^api/query_interactive/', query_interactive_api,
                            name='query_interactive_api'),
                        url(r'^api/database_explorer/', database_explorer_api,
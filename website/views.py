@@ -1,11 +1,18 @@
-from django.http import HttpResponse
-from django.shortcuts import render_to_response
+from django.http import (HttpResponse, HttpResponseNotModified,
+                         StreamingHttpResponse)
+from django.shortcuts import render_to_response, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import require_POST
 from django.template import RequestContext
 from django.contrib.auth.models import User
 from django.db.models import Q
+from django.db import connection
+from django.conf import settings
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
 from itertools import chain
+from multiprocessing.pool import ThreadPool
 
 import json
 import time
@@ -16,6 +23,11 @@ import favit.models
 import query
 import models
 import sql_manager
+import get_db_engine
+import jobs
+import payload_cache
+import acl_cache
+import definition_cache
 
 from ml.models import machine_learning_model
 from date_time_encoder import DateTimeEncoder
@@ -30,6 +42,9 @@ def index(request):
 
     # Get Favorites
     user = User.objects.get(username=request.user)
+    # Only list queries the user may run
+    allowed = acl_cache.allowed_query_ids(user, [q.id for q in query_list])
+    query_list = [q for q in query_list if q.id in allowed]
     query_favorites = favit.models.Favorite.objects.\
         for_user(user, model=models.Query)
     query_fav_dict = {}
@@ -68,26 +83,111 @@ def index(request):
 
 @login_required
 def query_api(request, query_id):
+    # Tags of the other encoding are accepted too, the data is the same
+    etags = [e.replace('-gzip', '') for e in parse_etags(
+        request.META.get('HTTP_IF_NONE_MATCH', ''))]
+    body, gzipped, etag = query_payload(
+        query_id, request.user, request.GET.dict(), etags)
+    if body is None:
+        response = HttpResponseNotModified()
+        response['ETag'] = quote_etag(etag)
+    else:
+        response = payload_response(request, body, gzipped, etag)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def payload_response(request, body, gzipped=None, etag=None):
+    """
+    Returns a JSON response, using the precompressed copy when the
+    client accepts gzip
+    """
+    if gzipped is not None and \
+            'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(gzipped, content_type="application/json")
+        response['Content-Encoding'] = 'gzip'
+        if etag is not None:
+            etag += '-gzip'
+    else:
+        response = HttpResponse(body, content_type="application/json")
+    if etag is not None:
+        response['ETag'] = quote_etag(etag)
+        # Browsers revalidate with If-None-Match instead of refetching
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+def dashboard_api(request, dashboard_id):
+    dashboard_query_list = models.DashboardQuery.objects.filter(
+        dashboard_id=dashboard_id).order_by('order')
+    query_id_array = [str(dq.query_id) for dq in dashboard_query_list]
+    return query_batch_response(request, query_id_array)
+
+
+@login_required
+def query_batch_api(request, query_ids):
+    # The URL allows stray commas, skip the empty ids they leave
+    return query_batch_response(
+        request, [i for i in query_ids.split(',') if i])
+
+
+def query_payload(query_id, user, parameters, etags=()):
+    """
+    Runs a query and returns the query API response as JSON
+    parameters are the GET parameters of the request
+    returns (body, gzipped body or None, etag or None), responses built
+    from the cache are kept and reused until the cache entry changes
+    body is None when the response would have one of etags
+    """
     try:
         start_time = time.time()
         lq = query.LoadQuery(
             query_id=query_id,
-            user=request.user,
-            parameters=request.GET.dict(),
-            cacheable=request.GET.get('cacheable', None)
+            user=user,
+            parameters=parameters,
+            cacheable=parameters.get('cacheable', None),
+            force_refresh=parameters.get('force_refresh', False)
         )
+        output_format = parameters.get('format', 'array')
         q = lq.prepare_query()
+        q.prepare_safety()
+        q.check_permission()
+        identity = q.payload_identity(output_format)
+        etag = None
+        if identity is not None:
+            etag = payload_cache.etag(identity)
+            if etag in etags or '*' in etags:
+                q.record_payload_hit()
+                return (None, None, etag)
+            payload = payload_cache.get(identity)
+            if payload is not None:
+                q.record_payload_hit()
+                return payload + (etag,)
         q.run_query()
-        q.run_manipulations()
-        response_data = q.data_array
+        q.run_manipulations(output_format)
+        response_data = manipulated_data(q, output_format)
         time_elapsed = time.time() - start_time
         # logging.warning('Cache Status View %s' % (q.get_cache_status()))
         return_data = {
-            "data":
-                {"columns": response_data.pop(0), "data": response_data},
+            "data": response_data,
             "time_elapsed": round(time_elapsed, 2),
             "cached": q.get_cache_status(),
             "error": False}
+        if q.get_cache_status() and identity is None:
+            # The cache was written while this request waited for it
+            cache_run_time = q.cache_run_time
+            identity = q.payload_identity(output_format)
+            if identity is not None and identity[3] != cache_run_time:
+                identity = None
+            etag = payload_cache.etag(identity) if identity else None
+        if q.get_cache_status() and identity is not None and \
+                identity[3] == q.cache_run_time:
+            # Later hits are served this body as is
+            return_data['time_elapsed'] = 0
+            return payload_cache.put(
+                identity, json.dumps(return_data, cls=DateTimeEncoder)
+            ) + (etag,)
     except Exception, e:
         # logging.warning(str(sys.exc_info()) + str(e))
         logging.warning(traceback.format_exc())
@@ -96,11 +196,138 @@ def query_api(request, query_id):
             "time_elapsed": 0,
             "cached": False,
             "error": True}
+    return (json.dumps(return_data, cls=DateTimeEncoder), None, None)
+
+
+def manipulated_data(q, output_format='array'):
+    """
+    Returns the data of a manipulated query in the API's format
+    """
+    if output_format == 'columnar':
+        return q.data_columns
+    response_data = q.data_array
+    return {"columns": response_data.pop(0), "data": response_data}
+
+
+@login_required
+def query_job_submit(request, query_id):
+    # Refuse jobs that could only fail, unknown queries are a 404
+    definition_cache.get(query_id)
+    try:
+        lq = query.LoadQuery(query_id=query_id, user=request.user)
+        lq.load_query()
+        lq.query.check_permission()
+    except Exception, e:
+        logging.warning(traceback.format_exc())
+        return HttpResponse(
+            json.dumps({"data": str(e), "error": True}),
+            content_type="application/json")
+    job = jobs.submit_job(query_id, request.user, request.GET.dict())
+    return HttpResponse(
+        json.dumps(jobs.job_status(job), cls=DateTimeEncoder),
+        content_type="application/json")
+
+
+@login_required
+def query_job_status(request, job_id):
+    job = get_object_or_404(
+        models.QueryJob, pk=job_id, user_id=request.user.id)
+    return HttpResponse(
+        json.dumps(jobs.job_status(job), cls=DateTimeEncoder),
+        content_type="application/json")
+
+
+@login_required
+def query_job_result(request, job_id):
+    job = get_object_or_404(
+        models.QueryJob, pk=job_id, user_id=request.user.id)
+    try:
+        output_format = request.GET.get('format', 'array')
+        q = jobs.job_result(job, output_format)
+        return_data = {
+            "data": manipulated_data(q, output_format),
+            "time_elapsed": round(job.execution_time, 2),
+            "cached": job.cached,
+            "error": False}
+    except Exception, e:
+        logging.warning(traceback.format_exc())
+        return_data = {
+            "data": str(e),
+            "time_elapsed": 0,
+            "cached": False,
+            "error": True}
     return HttpResponse(
         json.dumps(return_data, cls=DateTimeEncoder),
         content_type="application/json")
 
 
+@login_required
+@require_POST
+def query_cancel(request, query_id):
+    # Staff may cancel anyone's run of the query, others only their own
+    try:
+        lq = query.LoadQuery(query_id=query_id, user=request.user)
+        lq.load_query()
+        lq.query.check_permission()
+        cancelled = lq.query.cancel(all_users=request.user.is_staff)
+        return_data = {"data": cancelled, "error": False}
+    except Exception, e:
+        logging.warning(traceback.format_exc())
+        return_data = {"data": str(e), "error": True}
+    return HttpResponse(
+        json.dumps(return_data, cls=DateTimeEncoder),
+        content_type="application/json")
+
+
+def query_batch_response(request, query_id_array):
+    """
+    Runs many queries with the same parameters at the same time
+    Each result is streamed back as a line of JSON when it finishes
+    """
+    parameters = request.GET.dict()
+    user = request.user
+    db_ids = dict(models.Query.objects.filter(
+        id__in=query_id_array).values_list('id', 'db_id'))
+    # Decide every tile's permission at once, the tiles reuse the answers
+    acl_cache.allowed_query_ids(user, db_ids.keys())
+
+    def run_tile(query_id):
+        try:
+            # Bound how many tiles hit the same source database at once
+            semaphore = get_db_engine.get_db_semaphore(
+                db_ids.get(int(query_id)))
+            with semaphore:
+                body = query_payload(query_id, user, parameters)[0]
+            # Splice the id into the response object
+            return '{"query_id": %d, %s\n' % (int(query_id), body[1:])
+        except Exception, e:
+            # One failing tile must not end the stream
+            logging.warning(traceback.format_exc())
+            return json.dumps({
+                "query_id": int(query_id),
+                "data": str(e),
+                "time_elapsed": 0,
+                "cached": False,
+                "error": True}) + '\n'
+        finally:
+            connection.close()
+
+    def stream_tiles():
+        if len(query_id_array) == 0:
+            return
+        pool = ThreadPool(min(
+            len(query_id_array), getattr(settings, 'BATCH_THREADS', 8)))
+        try:
+            for line in pool.imap_unordered(run_tile, query_id_array):
+                yield line
+        finally:
+            pool.close()
+            pool.join()
+
+    return StreamingHttpResponse(
+        stream_tiles(), content_type="application/x-ndjson")
+
+
 @login_required
 def query_view(request, query_ids, type='query', **kwargs):
     query_id_array = query_ids.split(',')
@@ -199,12 +426,14 @@ def query_interactive_api(request):
         db = models.Db.objects.filter(id=request.POST['db']).first()
         pivot = request.POST.get('pivot', '').lower() == 'true'
         cumulative = request.POST.get('cumulative', '').lower() == 'true'
+        # Interactive results are only cached when asked for
+        cacheable = request.POST.get('cacheable', '').lower() == 'true'
         start_time = time.time()
         md = query.ManipulateData(
             query_text=query_text,
             db=db,
             user=request.user,
-            cacheable=False,
+            cacheable=cacheable,
         )
         md.prepare_safety()
         md.run_query()
@@ -232,6 +461,21 @@ def query_interactive_api(request):
                         content_type="application/json")
 
 
+@staff_member_required
+@require_POST
+def query_interactive_cancel(request):
+    # Cancels the user's running interactive queries on a database
+    try:
+        db = get_object_or_404(models.Db, pk=request.POST['db'])
+        rq = query.RunQuery(query_text='', db=db, user=request.user)
+        return_data = {"data": rq.cancel(), "error": False}
+    except Exception, e:
+        logging.warning(traceback.format_exc())
+        return_data = {"data": str(e), "error": True}
+    return HttpResponse(json.dumps(return_data, cls=DateTimeEncoder),
+                        content_type="application/json")
+
+
 @staff_member_required
 def database_explorer(request):
     # Render empty page for users to add data to